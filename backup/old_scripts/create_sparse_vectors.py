@@ -9,6 +9,7 @@ from pathlib import Path
 from collections import Counter, defaultdict
 import math
 import pickle
+import scipy.sparse as sp
 from konlpy.tag import Okt
 import re
 
@@ -118,6 +119,58 @@ class BM25Vectorizer:
                     sparse_vec[idx] = score
         
         return sparse_vec
+    
+    def transform_query_dense(self, query):
+        """쿼리를 어휘 크기의 밀집 벡터(np.float32)로 변환
+
+        transform_query와 같은 가중치. corpus CSR 행렬과 `corpus_csr @ q_dense`로 바로 곱할 수 있음
+        """
+        q_dense = np.zeros(len(self.vocab), dtype=np.float32)
+        for idx, score in self.transform_query(query).items():
+            q_dense[idx] = score
+        return q_dense
+
+def to_csr_matrix(sparse_vectors, vocab_size):
+    """{index: score} dict 리스트를 (문서 x 어휘) CSR 행렬로 변환
+
+    검색 시 문서마다 dict를 순회하지 않고 `corpus_csr @ query_vec` 한 번으로 점수 계산 가능
+    """
+    indptr = np.zeros(len(sparse_vectors) + 1, dtype=np.int64)
+    for i, vec in enumerate(sparse_vectors):
+        indptr[i + 1] = indptr[i] + len(vec)
+    
+    indices = np.empty(indptr[-1], dtype=np.int32)
+    data = np.empty(indptr[-1], dtype=np.float32)
+    for i, vec in enumerate(sparse_vectors):
+        start, end = indptr[i], indptr[i + 1]
+        indices[start:end] = list(vec.keys())
+        data[start:end] = list(vec.values())
+    
+    return sp.csr_matrix((data, indices, indptr), shape=(len(sparse_vectors), vocab_size))
+
+CSR_ARRAYS = ('indptr', 'indices', 'data', 'shape')
+
+def save_corpus_csr(csr, out_dir):
+    """CSR 행렬을 배열별 .npy 파일로 저장 (np.load(mmap_mode='r')로 바로 매핑 가능)
+
+    .npz 안의 배열은 mmap으로 열리지 않으므로 배열마다 비압축 .npy로 나눠 저장
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(exist_ok=True, parents=True)
+    np.save(out_dir / 'indptr.npy', csr.indptr)
+    np.save(out_dir / 'indices.npy', csr.indices)
+    np.save(out_dir / 'data.npy', csr.data)
+    np.save(out_dir / 'shape.npy', np.asarray(csr.shape, dtype=np.int64))
+
+def load_corpus_csr(out_dir):
+    """save_corpus_csr로 저장한 CSR 행렬을 메모리 매핑으로 로드 (pickle 역직렬화 없음)"""
+    out_dir = Path(out_dir)
+    arrays = {name: np.load(out_dir / f'{name}.npy', mmap_mode='r') for name in CSR_ARRAYS}
+    return sp.csr_matrix(
+        (arrays['data'], arrays['indices'], arrays['indptr']),
+        shape=tuple(int(n) for n in arrays['shape']),
+        copy=False
+    )
 
 def main():
     import argparse
@@ -147,11 +200,10 @@ def main():
         pickle.dump(vectorizer, f)
     print(f"\n✅ BM25 벡터화기 저장: {vectorizer_path}")
     
-    # Sparse vectors 저장
-    vectors_path = f"{args.output}_vectors.pkl"
-    with open(vectors_path, 'wb') as f:
-        pickle.dump(sparse_vectors, f)
-    print(f"✅ Sparse vectors 저장: {vectors_path}")
+    # Sparse vectors 저장 (문서별 dict pickle 대신 CSR 배열 → load_corpus_csr로 mmap 로드)
+    corpus_dir = f"{args.output}_corpus"
+    save_corpus_csr(to_csr_matrix(sparse_vectors, len(vectorizer.vocab)), corpus_dir)
+    print(f"✅ Sparse vectors (CSR) 저장: {corpus_dir}/")
     
     # 통계 출력
     non_zero_counts = [len(vec) for vec in sparse_vectors]
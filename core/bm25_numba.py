@@ -0,0 +1,75 @@
+# bm25_numba.py - BM25 희소 행렬 곱 Numba 커널 (scipy가 없을 때 단일 쿼리 점수, 평가 스크립트의 일괄 Top-K)
+from __future__ import annotations
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:  # numba가 없으면 bm25_spmv = None
+    njit = None
+
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def bm25_spmv(indptr, indices, data, q_dense, out):
+        """CSR (indptr, indices, data) x 밀집 쿼리 벡터 → out (문서 행 단위 병렬)"""
+        n_docs = indptr.shape[0] - 1
+        for i in prange(n_docs):
+            s = np.float32(0.0)
+            for k in range(indptr[i], indptr[i + 1]):
+                s += data[k] * q_dense[indices[k]]
+            out[i] = s
+        return out
+
+    @njit(parallel=True, cache=True)
+    def bm25_topk(q_indptr, q_indices, q_data, w_indptr, w_indices, w_data, n_docs, topk_out, topk_scores):
+        """(쿼리 x 어휘) CSR x (어휘 x 문서) CSR → 쿼리별 Top-K 인덱스/점수 (쿼리 단위 병렬)
+        
+        점수 행렬 (쿼리 x 문서) 전체를 만들지 않고 쿼리마다 문서 점수 벡터 하나만 사용
+        Top-K는 전체 정렬 없이 크기 K의 삽입 버퍼로 선택 (점수 내림차순, 동점은 인덱스 오름차순
+        → eval_hybrid.top_k_ranked와 같은 순서)
+        """
+        n_queries = q_indptr.shape[0] - 1
+        top_k = topk_out.shape[1]
+        for qi in prange(n_queries):
+            scores = np.zeros(n_docs, dtype=np.float32)
+            for a in range(q_indptr[qi], q_indptr[qi + 1]):
+                term = q_indices[a]
+                weight = q_data[a]
+                for b in range(w_indptr[term], w_indptr[term + 1]):
+                    scores[w_indices[b]] += weight * w_data[b]
+            
+            # 문서를 인덱스 오름차순으로 보므로 동점이면 먼저 들어온 (작은 인덱스) 문서가 앞에 남음
+            filled = 0
+            for d in range(n_docs):
+                s = scores[d]
+                if filled == top_k:
+                    if s <= topk_scores[qi, top_k - 1]:
+                        continue
+                    pos = top_k - 1
+                else:
+                    pos = filled
+                    filled += 1
+                while pos > 0 and topk_scores[qi, pos - 1] < s:
+                    topk_scores[qi, pos] = topk_scores[qi, pos - 1]
+                    topk_out[qi, pos] = topk_out[qi, pos - 1]
+                    pos -= 1
+                topk_scores[qi, pos] = s
+                topk_out[qi, pos] = d
+        return topk_out, topk_scores
+else:
+    bm25_spmv = None
+    bm25_topk = None
+
+
+def warmup_bm25_spmv() -> None:
+    """작은 입력으로 한 번 호출해 JIT 컴파일(또는 cache=True 디스크 캐시 로드)을 미리 끝냄
+    (인덱스 구축 시 호출하면 첫 검색 쿼리가 컴파일 시간을 떠안지 않음)"""
+    if bm25_spmv is None:
+        return
+    bm25_spmv(
+        np.zeros(2, dtype=np.int64),
+        np.zeros(1, dtype=np.int32),
+        np.zeros(1, dtype=np.float32),
+        np.zeros(1, dtype=np.float32),
+        np.empty(1, dtype=np.float32),
+    )
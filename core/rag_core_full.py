@@ -10,8 +10,15 @@ from qdrant_client import QdrantClient
 from qdrant_client.http import models as qm
 from openai import OpenAI
 from rank_bm25 import BM25Okapi
+import numpy as np
 import re
 
+try:
+    import scipy.sparse as sp
+except ImportError:  # scipy가 없으면 Numba 커널(core.bm25_numba)로 BM25 점수 계산
+    sp = None
+
+from core.bm25_numba import bm25_spmv, warmup_bm25_spmv
 from core.router import classify_query_intent
 
 load_dotenv()
@@ -23,6 +30,8 @@ QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
 COLLECTION_NAME = os.getenv("QDRANT_COLLECTION", "kitbot_docs_bge")
 EMBED_MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "BAAI/bge-m3")
 OPENAI_MODEL = os.getenv("OPENAI_CHAT_MODEL", "gpt-4o-mini")
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "0") == "1"  # gRPC(6334) 전송 사용 여부
+BM25_SCROLL_BATCH = int(os.getenv("BM25_SCROLL_BATCH", "2000"))  # BM25 인덱스 구축 시 scroll 페이지 크기
 
 # --------------------
 # 싱글톤
@@ -33,12 +42,14 @@ _llm_client: OpenAI | None = None
 _reranker_model: CrossEncoder | None = None
 _bm25_index = None
 _bm25_documents = None
+_bm25_matrix = None
+_bm25_vocab = None
 
 
 def get_qdrant_client() -> QdrantClient:
     global _qdrant_client
     if _qdrant_client is None:
-        _qdrant_client = QdrantClient(url=QDRANT_URL)
+        _qdrant_client = QdrantClient(url=QDRANT_URL, prefer_grpc=QDRANT_PREFER_GRPC)
     return _qdrant_client
 
 
@@ -98,7 +109,7 @@ def tokenize_korean(text: str) -> List[str]:
 
 def build_bm25_index():
     """Qdrant에서 모든 문서를 로드하여 BM25 인덱스 구축"""
-    global _bm25_index, _bm25_documents
+    global _bm25_index, _bm25_documents, _bm25_matrix, _bm25_vocab
     
     if _bm25_index is not None:
         return _bm25_index, _bm25_documents
@@ -106,9 +117,10 @@ def build_bm25_index():
     print("🔍 BM25 인덱스 구축 중...")
     client = get_qdrant_client()
     
+    # 큰 페이지로 스크롤해 왕복 횟수 최소화
     documents = []
     offset = None
-    batch_size = 100
+    batch_size = BM25_SCROLL_BATCH
     
     while True:
         result = client.scroll(
@@ -150,12 +162,61 @@ def build_bm25_index():
     tokenized_corpus = [tokenize_korean(doc['text']) for doc in documents]
     _bm25_index = BM25Okapi(tokenized_corpus)
     _bm25_documents = documents
+    _bm25_matrix, _bm25_vocab = build_bm25_matrix(_bm25_index)
+    if sp is None:
+        warmup_bm25_spmv()  # Numba 커널을 인덱스 구축 시점에 미리 컴파일
     
     print(f"   ✅ BM25 인덱스 생성 완료")
     
     return _bm25_index, _bm25_documents
 
 
+def build_bm25_matrix(bm25: BM25Okapi) -> Tuple[Any, Dict[str, int]]:
+    """BM25Okapi의 문서별 term 가중치를 (문서 x 어휘) CSR 행렬로 미리 계산
+    (scipy가 없으면 (indptr, indices, data) 배열 튜플로 반환)"""
+    vocab: Dict[str, int] = {}
+    indptr = [0]
+    indices: List[int] = []
+    data: List[float] = []
+    
+    for doc_len, freqs in zip(bm25.doc_len, bm25.doc_freqs):
+        norm = bm25.k1 * (1 - bm25.b + bm25.b * doc_len / bm25.avgdl)
+        for term, tf in freqs.items():
+            idf = bm25.idf.get(term)
+            if not idf:
+                continue
+            indices.append(vocab.setdefault(term, len(vocab)))
+            data.append(idf * tf * (bm25.k1 + 1) / (tf + norm))
+        indptr.append(len(indices))
+    
+    arrays = (np.asarray(indptr, dtype=np.int64), np.asarray(indices, dtype=np.int32), np.asarray(data, dtype=np.float32))
+    if sp is None:
+        return arrays, vocab
+    
+    matrix = sp.csr_matrix((arrays[2], arrays[1], arrays[0]), shape=(len(bm25.doc_freqs), len(vocab)))
+    return matrix, vocab
+
+
+def bm25_get_scores(tokenized_query: List[str]) -> np.ndarray:
+    """BM25Okapi.get_scores와 같은 점수를 희소 행렬-벡터 곱 한 번으로 계산"""
+    build_bm25_index()
+    
+    # 쿼리 term 빈도 벡터 (중복 토큰은 get_scores처럼 횟수만큼 더해짐)
+    query_vec = np.zeros(len(_bm25_vocab), dtype=np.float32)
+    for token in tokenized_query:
+        idx = _bm25_vocab.get(token)
+        if idx is not None:
+            query_vec[idx] += 1.0
+    
+    if sp is not None:
+        return _bm25_matrix @ query_vec
+    if bm25_spmv is not None:
+        indptr, indices, data = _bm25_matrix
+        return bm25_spmv(indptr, indices, data, query_vec, np.empty(len(indptr) - 1, dtype=np.float32))
+    # scipy/numba 둘 다 없으면 rank_bm25 기본 구현 사용
+    return _bm25_index.get_scores(tokenized_query)
+
+
 # --------------------
 # 하이브리드 검색 + 리랭커
 # --------------------
@@ -190,7 +251,7 @@ def hybrid_search_with_reranker(query: str, top_k: int = 5, alpha: float = 0.85)
     # 2. BM25 검색
     bm25_index, bm25_documents = build_bm25_index()
     tokenized_query = tokenize_korean(query)
-    bm25_scores = bm25_index.get_scores(tokenized_query)
+    bm25_scores = bm25_get_scores(tokenized_query)
     
     # 개선된 Min-Max 정규화
     if len(bm25_scores) > 0:
@@ -205,9 +266,10 @@ def hybrid_search_with_reranker(query: str, top_k: int = 5, alpha: float = 0.85)
         bm25_scores_normalized = bm25_scores
     
     # BM25 상위 문서만 선택
-    top_bm25_indices = sorted(range(len(bm25_scores_normalized)), 
-                               key=lambda i: bm25_scores_normalized[i], 
-                               reverse=True)[:semantic_limit]
+    # argpartition으로 상위 후보만 고른 뒤 그 안에서만 정렬
+    n_top = min(semantic_limit, len(bm25_scores_normalized))
+    top_bm25_indices = np.argpartition(-bm25_scores_normalized, n_top - 1)[:n_top] if n_top else np.array([], dtype=int)
+    top_bm25_indices = top_bm25_indices[np.argsort(-bm25_scores_normalized[top_bm25_indices])]
     
     bm25_score_dict = {}
     for idx in top_bm25_indices:
@@ -1,5 +1,6 @@
 # router.py
 from __future__ import annotations
+import re
 from typing import List, Dict, Any
 
 # 1) 쿼리 → intent 분류 (아주 가벼운 룰)
@@ -20,6 +21,22 @@ DORM_KEYWORDS = ["생활관", "기숙사", "오름관", "푸름관", "입사", "
 EMPLOYMENT_KEYWORDS = ["취업", "채용", "인턴", "일자리", "현장실습", "LINC", "진로", "구인"]
 EVENT_KEYWORDS = ["행사", "특강", "축제", "세미나", "공모전", "대회", "봉사", "OT", "오티"]
 
+def _keyword_pattern(keywords: List[str]) -> "re.Pattern[str]":
+    """키워드 목록 → 부분 문자열 매칭용 정규식 (키워드마다 `in` 검사하지 않고 한 번에 탐색)"""
+    return re.compile("|".join(map(re.escape, keywords)))
+
+# 의도별 키워드 패턴 (모듈 로드 시 한 번만 컴파일, 순서가 우선순위)
+_INTENT_PATTERNS = [
+    ("chitchat", _keyword_pattern(CHITCHAT_KEYWORDS)),
+    ("bus", _keyword_pattern(BUS_KEYWORDS)),
+    ("schedule", _keyword_pattern(SCHEDULE_KEYWORDS)),
+    ("menu", _keyword_pattern(MENU_KEYWORDS)),
+    ("scholarship", _keyword_pattern(SCHOLARSHIP_KEYWORDS)),
+    ("dorm", _keyword_pattern(DORM_KEYWORDS)),
+    ("employment", _keyword_pattern(EMPLOYMENT_KEYWORDS)),
+    ("event", _keyword_pattern(EVENT_KEYWORDS)),
+]
+
 def classify_query_intent(query: str) -> str:
     """
     사용자 질문을 분석하여 의도(Intent)를 반환
@@ -31,18 +48,10 @@ def classify_query_intent(query: str) -> str:
     """
     q = query.strip()
     
-    # 🔴 [추가] 일상 대화 먼저 체크 (검색 생략)
-    if any(kw in q for kw in CHITCHAT_KEYWORDS): 
-        return "chitchat"
-
-    # 키워드 매칭 (순서가 중요할 수 있음)
-    if any(kw in q for kw in BUS_KEYWORDS): return "bus"
-    if any(kw in q for kw in SCHEDULE_KEYWORDS): return "schedule"
-    if any(kw in q for kw in MENU_KEYWORDS): return "menu"
-    if any(kw in q for kw in SCHOLARSHIP_KEYWORDS): return "scholarship"
-    if any(kw in q for kw in DORM_KEYWORDS): return "dorm"
-    if any(kw in q for kw in EMPLOYMENT_KEYWORDS): return "employment"
-    if any(kw in q for kw in EVENT_KEYWORDS): return "event"
+    # 🔴 [추가] 일상 대화 먼저 체크 (검색 생략) → 이후 키워드 매칭 (순서가 중요할 수 있음)
+    for intent, pattern in _INTENT_PATTERNS:
+        if pattern.search(q):
+            return intent
     
     return "general" # 그 외 일반 질문
 # ---------------------------------------------------------
@@ -127,15 +127,12 @@ def evaluate_embedding_quality(embeddings):
     print(f"\n📊 임베딩 품질 분석...")
     
     # 코사인 유사도 분포 분석
-    similarities = []
+    # 쌍마다 np.dot을 부르지 않고 GEMM 한 번으로 전체 유사도 행렬을 구한 뒤 상삼각(i < j)만 사용
     sample_size = min(100, len(embeddings))
+    sample = np.asarray(embeddings[:sample_size])
+    sim_matrix = sample @ sample.T
     
-    for i in range(sample_size):
-        for j in range(i+1, sample_size):
-            sim = np.dot(embeddings[i], embeddings[j])
-            similarities.append(sim)
-    
-    similarities = np.array(similarities)
+    similarities = sim_matrix[np.triu_indices(sample_size, k=1)]
     
     stats = {
         'mean': float(np.mean(similarities)),
@@ -186,13 +183,28 @@ def evaluate_retrieval_performance(model, texts, queries, df, query_to_doc):
             doc_name_to_indices[doc_name] = []
         doc_name_to_indices[doc_name].append(idx)
     
-    # 각 쿼리에 대해 검색
-    recall_at_1 = []
-    recall_at_5 = []
-    mrr_scores = []
-    ndcg_scores = []
+    # 문서명 → 청크 인덱스 배열 (쿼리마다 set을 새로 만들지 않도록 한 번만 변환)
+    name_to_mask_ids = {
+        name: np.array(idxs, dtype=np.int64)
+        for name, idxs in doc_name_to_indices.items()
+    }
+    num_docs = len(doc_embeddings)
+    
+    # 전체 쿼리 x 문서 유사도를 한 번의 행렬곱으로 계산
+    # (normalize_embeddings=True이므로 내적 = 코사인 유사도)
+    all_similarities = query_embeddings @ doc_embeddings.T
+    
+    # 쿼리별 Top-5: argpartition(O(M))으로 후보를 고른 뒤 5개만 정렬
+    top_k = min(5, all_similarities.shape[1])
+    top_part = np.argpartition(-all_similarities, top_k - 1, axis=1)[:, :top_k]
+    top_scores = np.take_along_axis(all_similarities, top_part, axis=1)
+    all_top_k = np.take_along_axis(top_part, np.argsort(-top_scores, axis=1), axis=1)
     
-    evaluated_queries = 0
+    # 순위별 할인값 (NDCG)
+    discounts = 1.0 / np.log2(np.arange(2, 7))
+    
+    # 각 쿼리의 순위별 정답 여부만 모으고, 지표는 루프 밖에서 한 번에 계산
+    hit_rows = []
     
     for q_idx, query in enumerate(queries):
         # Ground Truth 확인
@@ -200,59 +212,32 @@ def evaluate_retrieval_performance(model, texts, queries, df, query_to_doc):
             continue
         
         gt_doc_name = query_to_doc[query]
+        if not isinstance(gt_doc_name, str):
+            continue
         
         # GT 문서의 인덱스들 찾기 (부분 매칭!)
         # GT: "2023-2학기 버스.pdf" → Corpus: "2023-2학기 버스.pdf_chunk0"
-        gt_indices = set()
-        for doc_name, indices in doc_name_to_indices.items():
-            # NaN이나 float 타입 건너뛰기
-            if not isinstance(doc_name, str):
-                continue
-            if not isinstance(gt_doc_name, str):
-                continue
-            
+        gt_prefix = gt_doc_name.replace('.pdf', '')
+        pos_list = [
+            ids for doc_name, ids in name_to_mask_ids.items()
             # 부분 매칭: GT가 doc_name에 포함되어 있으면 OK
-            if gt_doc_name in doc_name or doc_name.startswith(gt_doc_name.replace('.pdf', '')):
-                gt_indices.update(indices)
+            if gt_doc_name in doc_name or doc_name.startswith(gt_prefix)
+        ]
         
-        if not gt_indices:
+        if not pos_list:
             # 매칭되는 청크가 없으면 스킵
             continue
         
-        # 쿼리 임베딩으로 검색
-        q_emb = query_embeddings[q_idx]
-        similarities = np.dot(doc_embeddings, q_emb)
+        gt_mask = np.zeros(num_docs, dtype=bool)
+        gt_mask[np.concatenate(pos_list)] = True
         
         # Top-K 인덱스
-        top_k_indices = np.argsort(similarities)[::-1][:5]
-        
-        # Recall@K 계산
-        found_at_1 = any(idx in gt_indices for idx in top_k_indices[:1])
-        found_at_5 = any(idx in gt_indices for idx in top_k_indices[:5])
-        
-        recall_at_1.append(1.0 if found_at_1 else 0.0)
-        recall_at_5.append(1.0 if found_at_5 else 0.0)
+        top_k_indices = all_top_k[q_idx]
         
-        # MRR 계산
-        reciprocal_rank = 0.0
-        for rank, idx in enumerate(top_k_indices, 1):
-            if idx in gt_indices:
-                reciprocal_rank = 1.0 / rank
-                break
-        mrr_scores.append(reciprocal_rank)
-        
-        # NDCG 계산 (간단 버전)
-        dcg = 0.0
-        for rank, idx in enumerate(top_k_indices, 1):
-            if idx in gt_indices:
-                dcg += 1.0 / np.log2(rank + 1)
-        
-        # Ideal DCG (정답이 1위일 때)
-        idcg = 1.0 / np.log2(2)
-        ndcg = dcg / idcg if idcg > 0 else 0.0
-        ndcg_scores.append(ndcg)
-        
-        evaluated_queries += 1
+        # 정답 여부 (순위별)
+        hit_rows.append(gt_mask[top_k_indices])
+    
+    evaluated_queries = len(hit_rows)
     
     if evaluated_queries == 0:
         print("   ⚠️ 평가 가능한 쿼리가 없습니다!")
@@ -263,11 +248,22 @@ def evaluate_retrieval_performance(model, texts, queries, df, query_to_doc):
             'ndcg': 0.0
         }
     
+    # (평가 쿼리 x 순위) 정답 행렬
+    hits = np.stack(hit_rows)
+    found = hits.any(axis=1)
+    
+    # MRR: 첫 정답 순위의 역수 (정답 없으면 0)
+    reciprocal_ranks = np.where(found, 1.0 / (hits.argmax(axis=1) + 1), 0.0)
+    
+    # NDCG (간단 버전): Ideal DCG는 정답이 1위일 때 = 1 / log2(2) = 1
+    idcg = 1.0 / np.log2(2)
+    dcg = hits @ discounts[:hits.shape[1]]
+    
     results = {
-        'recall@1': np.mean(recall_at_1),
-        'recall@5': np.mean(recall_at_5),
-        'mrr': np.mean(mrr_scores),
-        'ndcg': np.mean(ndcg_scores)
+        'recall@1': hits[:, 0].mean(),
+        'recall@5': hits[:, :5].any(axis=1).mean(),
+        'mrr': reciprocal_ranks.mean(),
+        'ndcg': (dcg / idcg).mean()
     }
     
     print(f"   평가 쿼리: {evaluated_queries}개")
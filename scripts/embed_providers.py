@@ -1,10 +1,54 @@
 from __future__ import annotations
+import asyncio
+import math
 import os
-from typing import List, Callable, Tuple
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Iterable, List, Callable, Tuple, Union
 from pathlib import Path
 from dotenv import load_dotenv
 load_dotenv(dotenv_path=Path.cwd()/".env")  # 실행 디렉터리 기준
 
+# ===== 선택 의존성: 모듈 로드 시 한 번만 import (없으면 None, 사용 시점에 에러) =====
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+try:
+    from openai import AsyncOpenAI
+except ImportError:
+    AsyncOpenAI = None
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+except ImportError:
+    requests = None
+
+# 임베딩 응답(수 MB의 float 배열) 파싱은 orjson이 훨씬 빠름 (없으면 표준 json)
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+    _json_loads = json.loads
+
+# numpy가 있으면 모든 provider가 (N, d) float32 ndarray를 그대로 반환 (불필요한 list 변환 제거)
+Vectors = Union[List[List[float]], "np.ndarray"]
+
 # ===== 기본 모델명 (환경변수로 덮어쓰기 가능) =====
 DEFAULTS = {
     "e5":      os.getenv("E5_MODEL", "intfloat/multilingual-e5-base"),
@@ -16,90 +60,158 @@ DEFAULTS = {
 }
 
 # ===== BGE / E5 (Sentence-Transformers) =====
-def _encode_sbert(texts: List[str], model_name: str, batch_size: int = None) -> Tuple[List[List[float]], int]:
-    from sentence_transformers import SentenceTransformer
-
+def _resolve_device() -> str:
     # device 결정: SBERT_DEVICE가 있으면 우선, 없으면 CUDA 자동 감지
     device = os.getenv("SBERT_DEVICE")
     if not device:
         try:
-            import torch
-            device = "cuda" if torch.cuda.is_available() else "cpu"
+            device = "cuda" if torch is not None and torch.cuda.is_available() else "cpu"
         except Exception:
             device = "cpu"
+    return device
+
+def _use_fp16(device: str) -> bool:
+    # GPU에서는 기본적으로 FP16 추론 (SBERT_FP16=0 으로 끌 수 있음)
+    return device.startswith("cuda") and os.getenv("SBERT_FP16", "1") == "1"
 
+@lru_cache(maxsize=4)
+def _get_sbert(model_name: str, device: str):
+    # 같은 (모델, 디바이스)는 한 번만 로드해서 재사용
+    if SentenceTransformer is None:
+        raise RuntimeError("sentence-transformers가 설치되어 있지 않습니다.")
     m = SentenceTransformer(model_name, device=device)
+    if _use_fp16(device):
+        m = m.half()
+    return m
 
-    bs = batch_size or int(os.getenv("SBERT_BATCH", "32"))
-    vecs = m.encode(
-        texts,
-        batch_size=bs,
-        show_progress_bar=True,
-        normalize_embeddings=True
-    ).tolist()
+def _encode_sbert(texts: List[str], model_name: str, batch_size: int = None) -> Tuple[np.ndarray, int]:
+    device = _resolve_device()
+    m = _get_sbert(model_name, device)
+
+    # encode()는 입력 전체를 길이순으로 정렬한 뒤 배치를 나누고 원래 순서로 되돌리므로
+    # 여기서 따로 길이 정렬할 필요 없음 (패딩 낭비는 배치 크기로만 조절)
+    # FP16이면 활성화 메모리가 절반이라 기본 배치를 키움
+    default_bs = "128" if _use_fp16(device) else "32"
+    bs = batch_size or int(os.getenv("SBERT_BATCH", default_bs))
+    # inference_mode: autograd 추적/버전 카운터를 끄고 추론만 수행
+    with torch.inference_mode():
+        vecs = m.encode(
+            texts,
+            batch_size=bs,
+            show_progress_bar=True,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        ).astype("float32", copy=False)
 
     return vecs, m.get_sentence_embedding_dimension()
 
-def _encode_bge(texts: List[str], model_name: str) -> Tuple[List[List[float]], int]:
+def _encode_bge(texts: List[str], model_name: str) -> Tuple[np.ndarray, int]:
     return _encode_sbert(texts, model_name)
 
-def _encode_e5(texts: List[str], model_name: str) -> Tuple[List[List[float]], int]:
+def _encode_e5(texts: List[str], model_name: str) -> Tuple[np.ndarray, int]:
     return _encode_sbert(texts, model_name)
 
 # ===== KoSimCSE / KR-SBERT (한글 특화 모델) =====
-def _encode_kosimcse(texts: List[str], model_name: str) -> Tuple[List[List[float]], int]:
+def _encode_kosimcse(texts: List[str], model_name: str) -> Tuple[np.ndarray, int]:
     return _encode_sbert(texts, model_name)
 
-def _encode_krsbert(texts: List[str], model_name: str) -> Tuple[List[List[float]], int]:
+def _encode_krsbert(texts: List[str], model_name: str) -> Tuple[np.ndarray, int]:
     return _encode_sbert(texts, model_name)
 
 # ===== OpenAI =====
-def _encode_openai(texts: List[str], model_name: str) -> Tuple[List[List[float]], int]:
-    from openai import OpenAI
+def _encode_openai(texts: List[str], model_name: str) -> Tuple[Vectors, int]:
+    if AsyncOpenAI is None:
+        raise RuntimeError("openai 패키지가 설치되어 있지 않습니다.")
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY가 설정되어 있지 않습니다.")
-    client = OpenAI(api_key=api_key)
 
-    out: List[List[float]] = []
     B = int(os.getenv("OPENAI_BATCH", "256"))
-    for i in range(0, len(texts), B):
-        batch = texts[i:i+B]
-        resp = client.embeddings.create(model=model_name, input=batch)
-        out.extend([d.embedding for d in resp.data])
+    concurrency = int(os.getenv("OPENAI_CONCURRENCY", "8"))
+
+    # 배치 요청을 동시에 보내되, 세마포어로 동시 요청 수를 제한 (rate limit 보호)
+    async def _run():
+        client = AsyncOpenAI(api_key=api_key)
+        sem = asyncio.Semaphore(concurrency)
+
+        async def one(batch: List[str]):
+            async with sem:
+                return await client.embeddings.create(model=model_name, input=batch)
+
+        try:
+            return await asyncio.gather(*(one(texts[i:i+B]) for i in range(0, len(texts), B)))
+        finally:
+            await client.close()
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        results = asyncio.run(_run())
+    else:
+        # 이미 이벤트 루프가 도는 중 (Jupyter, async 호출자) → asyncio.run 불가, 별도 스레드의 새 루프에서 실행
+        # (호출은 이전 동기 구현처럼 결과가 나올 때까지 블록됨)
+        with ThreadPoolExecutor(max_workers=1) as ex:
+            results = ex.submit(asyncio.run, _run()).result()
+    # gather는 입력 순서를 보존하므로 그대로 이어붙이면 됨
+    out: List[List[float]] = [d.embedding for r in results for d in r.data]
 
     # ★ 추가: 정규화
     out = _l2_normalize(out)
-    dim = len(out[0]) if out else 0
+    dim = len(out[0]) if len(out) else 0
     return out, dim
 
 # ===== Upstage (REST; OpenAI 유사 포맷 가정) =====
-def _encode_upstage(texts: List[str], model_name: str) -> Tuple[List[List[float]], int]:
-    import requests
+_UPSTAGE_SESSION = None
+
+def _get_upstage_session():
+    """배치마다 TCP/TLS 핸드셰이크를 반복하지 않도록 커넥션 풀을 가진 세션을 재사용"""
+    global _UPSTAGE_SESSION
+    if _UPSTAGE_SESSION is None:
+        if requests is None:
+            raise RuntimeError("requests 패키지가 설치되어 있지 않습니다.")
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(
+            pool_connections=int(os.getenv("UPSTAGE_POOL", "16")),
+            pool_maxsize=32,
+            # Retry는 기본적으로 POST를 재시도하지 않음 → 임베딩 요청은 멱등이므로 POST도 허용
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                              allowed_methods=frozenset({"POST"})),
+        ))
+        _UPSTAGE_SESSION = session
+    return _UPSTAGE_SESSION
+
+def _encode_upstage(texts: List[str], model_name: str) -> Tuple[Vectors, int]:
     api_key = os.getenv("UPSTAGE_API_KEY")
     if not api_key:
         raise RuntimeError("UPSTAGE_API_KEY가 설정되어 있지 않습니다.")
     endpoint = os.getenv("UPSTAGE_EMBED_ENDPOINT", "https://api.upstage.ai/v1/solar/embeddings")
     headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
 
-    out: List[List[float]] = []
     B = int(os.getenv("UPSTAGE_BATCH", "64"))
     timeout = int(os.getenv("UPSTAGE_TIMEOUT", "60"))
+    workers = int(os.getenv("UPSTAGE_CONCURRENCY", "8"))
+    session = _get_upstage_session()
 
-    for i in range(0, len(texts), B):
-        batch = texts[i:i+B]
-        r = requests.post(endpoint, json={"model": model_name, "input": batch}, headers=headers, timeout=timeout)
+    def one(batch: List[str]) -> List[List[float]]:
+        r = session.post(endpoint, json={"model": model_name, "input": batch}, headers=headers, timeout=timeout)
         r.raise_for_status()
-        data = r.json()
-        out.extend([item["embedding"] for item in data["data"]])
+        data = _json_loads(r.content)
+        return [item["embedding"] for item in data["data"]]
+
+    # 여러 배치를 풀의 커넥션 위에서 동시에 전송 (map은 입력 순서 유지)
+    batches = [texts[i:i+B] for i in range(0, len(texts), B)]
+    out: List[List[float]] = []
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        for vecs in ex.map(one, batches):
+            out.extend(vecs)
 
     # ★ 추가: 정규화
     out = _l2_normalize(out)
-    dim = len(out[0]) if out else 0
+    dim = len(out[0]) if len(out) else 0
     return out, dim
 
 # ===== Public API 1: ingest_multi.py 호환 (권장) =====
-def get_encoder(provider: str) -> Callable[[List[str], str], Tuple[List[List[float]], int]]:
+def get_encoder(provider: str) -> Callable[[List[str], str], Tuple[Vectors, int]]:
     """
     사용법:
         encoder = get_encoder("bge")
@@ -116,14 +228,38 @@ def get_encoder(provider: str) -> Callable[[List[str], str], Tuple[List[List[flo
         raise ValueError(f"Unknown provider: {provider}")
 
     # ★ 문서 인덱싱 전처리 래핑
-    def wrapped(texts: List[str], model_name: str) -> Tuple[List[List[float]], int]:
+    def wrapped(texts: List[str], model_name: str) -> Tuple[Vectors, int]:
         prepped = _prep_docs(texts, provider)
         return base(prepped, model_name)
 
     return wrapped
 
 # ===== Public API 2: (선택) 임베딩함수/차원함수 분리 버전 =====
-def _dim_by_single_call(encode_fn: Callable[[List[str], str], Tuple[List[List[float]], int]], model_name: str) -> int:
+# 알려진 API 모델 차원
+_KNOWN_DIMS = {
+    "text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-ada-002": 1536,
+}
+# 실제 임베딩 호출에서 얻은 차원 캐시 (모델명 → 차원)
+_DIM_CACHE: dict[str, int] = {}
+
+_SBERT_PROVIDERS = {"bge", "e5", "kosimcse", "krsbert"}
+
+def _dim_without_encoding(provider: str, model_name: str) -> int:
+    """인코딩 호출 없이 알 수 있는 차원 (모르면 0)"""
+    if model_name in _KNOWN_DIMS:
+        return _KNOWN_DIMS[model_name]
+    if provider.lower() in _SBERT_PROVIDERS:
+        try:
+            # Dense 투영 모듈이 있는 모델은 config의 hidden_size와 출력 차원이 다르므로
+            # 모델에 실제 출력 차원을 물어봄 (_get_sbert 캐시 → 이후 인코딩에서 그대로 재사용)
+            return int(_get_sbert(model_name, _resolve_device()).get_sentence_embedding_dimension() or 0)
+        except Exception:
+            return 0
+    return 0
+
+def _dim_by_single_call(encode_fn: Callable[[List[str], str], Tuple[Vectors, int]], model_name: str) -> int:
     vecs, dim = encode_fn(["__dim_probe__"], model_name)
     return dim if dim else len(vecs[0])
 
@@ -137,17 +273,74 @@ def get_embedder(provider: str):
     enc = get_encoder(provider)
     default_model = DEFAULTS[provider.lower()]
 
-    def embed(texts: List[str], model_name: str = None) -> List[List[float]]:
+    def embed(texts: List[str], model_name: str = None) -> Vectors:
         m = model_name or default_model
-        vecs, _ = enc(texts, m)
+        vecs, dim = enc(texts, m)
+        if len(vecs):
+            _DIM_CACHE[m] = dim or len(vecs[0])
         return vecs
 
     def dim_fn(model_name: str = None) -> int:
         m = model_name or default_model
-        return _dim_by_single_call(enc, m)
+        if m not in _DIM_CACHE:
+            # 캐시 → 알려진 차원/모델 정보 순으로 확인하고, 둘 다 없을 때만 probe 호출
+            _DIM_CACHE[m] = _dim_without_encoding(provider, m) or _dim_by_single_call(enc, m)
+        return _DIM_CACHE[m]
 
     return embed, dim_fn, default_model
 
+# ===== Public API 4: 임베딩을 디스크(.npy memmap)에 바로 기록 =====
+def encode_to_memmap(texts: List[str], out_path, provider: str, model_name: str = None,
+                     dim: int = None, dtype: str = "float16", batch_size: int = None):
+    """
+    전체 임베딩을 메모리에 쌓지 않고 배치 단위로 .npy(memmap)에 기록
+    (RAM 사용량이 배치 하나 크기로 제한됨, 결과 파일은 np.load로 바로 사용 가능)
+
+    사용법:
+        mm = encode_to_memmap(texts, "embeddings/bge_all.npy", "bge")
+    """
+    B = batch_size or int(os.getenv("EMBED_STREAM_BATCH", "4096"))
+    batches = (texts[i:i+B] for i in range(0, len(texts), B))
+    return encode_batches_to_memmap(batches, len(texts), out_path, provider, model_name, dim, dtype)
+
+def encode_batches_to_memmap(batches: Iterable[List[str]], total: int, out_path, provider: str,
+                             model_name: str = None, dim: int = None, dtype: str = "float16"):
+    """
+    텍스트 배치 이터레이터를 순서대로 인코딩해 .npy(memmap)에 기록
+    (전체 텍스트 리스트도 메모리에 올리지 않음 - 예: pd.read_csv(chunksize=...) 스트림)
+    total은 전체 텍스트 수 (파일 shape를 미리 정하기 위해 필요)
+    """
+    if np is None:
+        raise RuntimeError("numpy가 설치되어 있지 않습니다.")
+    if total <= 0:
+        # 빈 memmap은 만들 수 없고, 차원도 첫 배치로 정할 수 없음
+        raise ValueError(f"인코딩할 텍스트가 없습니다 (total={total}).")
+
+    enc = get_encoder(provider)
+    model_name = model_name or DEFAULTS[provider.lower()]
+
+    mm = None
+    if dim:
+        mm = np.lib.format.open_memmap(out_path, mode="w+", dtype=dtype, shape=(total, dim))
+
+    offset = 0
+    for batch in batches:
+        if not batch:
+            continue
+        vecs, d = enc(batch, model_name)
+        vecs = np.asarray(vecs, dtype=np.float32)
+        if mm is None:
+            # 차원을 모르면 첫 배치 결과로 파일 생성
+            mm = np.lib.format.open_memmap(out_path, mode="w+", dtype=dtype,
+                                           shape=(total, d or vecs.shape[1]))
+        mm[offset:offset+len(vecs)] = vecs
+        offset += len(vecs)
+
+    if offset != total:
+        raise ValueError(f"인코딩된 텍스트 수({offset})가 total({total})과 다릅니다.")
+    mm.flush()
+    return mm
+
 # ===== Public API 3: 문서 전처리 함수 =====
 def _prep_docs(texts: List[str], provider: str) -> List[str]:
     p = provider.lower()
@@ -158,18 +351,19 @@ def _prep_docs(texts: List[str], provider: str) -> List[str]:
     # openai/upstage는 그대로
     return texts
 
-def _l2_normalize(vecs: List[List[float]]) -> List[List[float]]:
-    # numpy 없이도 가능하지만, 성능 때문에 numpy 권장
-    try:
-        import numpy as np
-        arr = np.asarray(vecs, dtype="float32")
+def _l2_normalize(vecs: List[List[float]]) -> Vectors:
+    # numpy 없이도 가능하지만, 성능 때문에 numpy 권장 (numpy면 ndarray 그대로 반환)
+    if np is not None:
+        if len(vecs) == 0:
+            return np.empty((0, 0), dtype=np.float32)
+        arr = np.ascontiguousarray(vecs, dtype=np.float32)
         norms = np.linalg.norm(arr, axis=1, keepdims=True)
         norms[norms == 0] = 1.0
-        return (arr / norms).tolist()
-    except Exception:
-        out = []
-        for v in vecs:
-            s = sum(x*x for x in v) ** 0.5 or 1.0
-            out.append([x/s for x in v])
-        return out
-
+        np.divide(arr, norms, out=arr)
+        return arr
+    out = []
+    for v in vecs:
+        row = array("f", v)
+        s = math.sqrt(math.fsum(x*x for x in row)) or 1.0
+        out.append([x/s for x in row])
+    return out
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+평가 스크립트 공용 클라이언트/시스템/모델
+
+evaluate_rag.py, evaluate_rag_quantitative.py, evaluate_generation_auto.py,
+eval_hybrid.py, regenerate_ground_truth.py, test_hybrid_bge.py, test_hybrid_search.py,
+test_reranking.py가 같은 프로세스에서 실행될 때 (노트북, 스윕 스크립트 등) RAGSystem·OpenAI·Qdrant
+클라이언트와 임베딩 모델을 한 번만 만들고 공유하도록 지연 싱글톤으로 제공.
+"""
+
+import os
+import sys
+from functools import lru_cache
+from pathlib import Path
+
+import httpx
+from dotenv import load_dotenv
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+load_dotenv()
+
+QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "0") == "1"  # gRPC(6334) 전송 사용 여부
+
+# keep-alive 커넥션 풀 크기 (동시 평가 요청 수보다 크게)
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+@lru_cache(maxsize=1)
+def get_openai_client():
+    """커넥션 풀을 공유하는 동기 OpenAI 클라이언트"""
+    from openai import OpenAI
+    return OpenAI(
+        api_key=os.getenv('OPENAI_API_KEY'),
+        http_client=httpx.Client(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+    )
+
+@lru_cache(maxsize=1)
+def get_async_openai_client():
+    """커넥션 풀을 공유하는 비동기 OpenAI 클라이언트 (evaluate_generation_auto 평가 요청용)"""
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(
+        api_key=os.getenv('OPENAI_API_KEY'),
+        http_client=httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+    )
+
+@lru_cache(maxsize=1)
+def get_qdrant_client():
+    """공용 Qdrant 클라이언트 (QDRANT_PREFER_GRPC=1이면 gRPC)"""
+    from qdrant_client import QdrantClient
+    return QdrantClient(url=QDRANT_URL, prefer_grpc=QDRANT_PREFER_GRPC)
+
+@lru_cache(maxsize=4)
+def get_embed_model(model_name='BAAI/bge-m3'):
+    """모델 이름별로 한 번만 로드되는 SentenceTransformer (GPU가 있으면 fp16)"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    model = SentenceTransformer(model_name, device=device)
+    if device == 'cuda':
+        model.half()
+    return model
+
+@lru_cache(maxsize=4)
+def get_rag(llm_provider='openai', llm_model='gpt-4o-mini'):
+    """(provider, model)별로 한 번만 초기화되는 RAGSystem (임베딩 모델 재로딩 방지)"""
+    from rag_demo import RAGSystem
+    return RAGSystem(llm_provider=llm_provider, llm_model=llm_model)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+하이브리드 검색 일괄 평가: BGE-M3 (로컬 임베딩) + BM25 (CSR)
+
+쿼리마다 Qdrant/BM25를 호출하지 않고 전체 쿼리에 대해 한 번에 계산:
+1. 희소: (쿼리 x 어휘) @ (어휘 x 문서) 희소 행렬곱 한 번
+2. 밀집: (쿼리 x 차원) @ (차원 x 문서) GEMM 한 번
+3. 각 점수 행렬에서 argpartition으로 Top-K 순위 → RRF 결합
+
+RRF는 청크 단위: 밀집/희소 모두 청크 하나가 순위 하나를 받음.
+test_hybrid_bge.py는 벡터 검색 결과의 RRF 점수를 같은 document_name/title의
+모든 청크에 나눠 주므로 두 스크립트의 수치는 직접 비교할 수 없음.
+
+필요 파일: data/corpus_all.csv, data/ground_truth_100.csv,
+          embeddings/bge_all.npy (regenerate_embeddings.py로 생성)
+"""
+
+import pandas as pd
+import numpy as np
+import scipy.sparse as sp
+from pathlib import Path
+from rank_bm25 import BM25Okapi
+import time
+from query_cache import default_cache_path, get_or_encode
+from eval_context import get_embed_model
+import warnings
+warnings.filterwarnings('ignore')
+
+try:
+    import pyarrow  # noqa: F401  (pandas의 pyarrow CSV 엔진용)
+    CSV_ENGINE = 'pyarrow'
+except ImportError:  # pyarrow가 없으면 pandas 기본 C 파서
+    CSV_ENGINE = 'c'
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DATA_DIR = PROJECT_ROOT / "data"
+EMBEDDINGS_PATH = PROJECT_ROOT / "embeddings" / "bge_all.npy"
+EMBED_MODEL = 'BAAI/bge-m3'
+
+def read_corpus_csv(path=DATA_DIR / "corpus_all.csv"):
+    """Corpus CSV 로드 (pyarrow가 있으면 멀티스레드 Arrow 파서, 결과 DataFrame은 동일)"""
+    return pd.read_csv(path, engine=CSV_ENGINE)
+
+def load_corpus():
+    """Corpus 로드 (regenerate_embeddings.py와 같은 필터 → 임베딩 행과 순서 일치)"""
+    corpus = read_corpus_csv()
+    corpus = corpus[corpus['text'].notna()]
+    corpus = corpus[corpus['text'].astype(str).str.strip() != ''].reset_index(drop=True)
+    corpus['text'] = corpus['text'].astype(str)
+    return corpus
+
+def build_bm25_csr(bm25):
+    """BM25Okapi의 문서별 term 가중치를 (어휘 x 문서) CSR 행렬로 변환
+    
+    쿼리 term 빈도 행렬과 곱하면 BM25Okapi.get_scores와 같은 점수가 나옴
+    """
+    vocab = {}
+    rows, cols, data = [], [], []
+    
+    for doc_idx, (doc_len, freqs) in enumerate(zip(bm25.doc_len, bm25.doc_freqs)):
+        norm = bm25.k1 * (1 - bm25.b + bm25.b * doc_len / bm25.avgdl)
+        for term, tf in freqs.items():
+            idf = bm25.idf.get(term)
+            if not idf:
+                continue
+            rows.append(vocab.setdefault(term, len(vocab)))
+            cols.append(doc_idx)
+            data.append(idf * tf * (bm25.k1 + 1) / (tf + norm))
+    
+    matrix = sp.csr_matrix(
+        (np.asarray(data, dtype=np.float32), (rows, cols)),
+        shape=(len(vocab), len(bm25.doc_freqs))
+    )
+    return matrix, vocab
+
+def query_term_matrix(queries, vocab):
+    """(쿼리 x 어휘) term 빈도 희소 행렬 (중복 토큰은 횟수만큼 누적)"""
+    rows, cols = [], []
+    for q_idx, query in enumerate(queries):
+        for token in query.split():
+            term_idx = vocab.get(token)
+            if term_idx is not None:
+                rows.append(q_idx)
+                cols.append(term_idx)
+    
+    data = np.ones(len(rows), dtype=np.float32)
+    return sp.csr_matrix((data, (rows, cols)), shape=(len(queries), len(vocab)))
+
+def top_k_ranked(scores, k):
+    """점수 행렬 (쿼리 x 문서)에서 행별 Top-K 인덱스 (점수 내림차순, 동점은 인덱스 오름차순)
+    
+    argpartition은 K번째 점수와 동점인 문서를 임의로 고르므로, K번째 점수보다 큰 문서는 모두 넣고
+    동점 문서는 인덱스가 작은 것부터 채움 → core.bm25_numba.bm25_topk와 같은 결과
+    """
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    kth_scores = np.take_along_axis(scores, part, axis=1).min(axis=1)
+    
+    ranked = np.empty((scores.shape[0], k), dtype=np.int64)
+    for q_idx, (row, kth) in enumerate(zip(scores, kth_scores)):
+        above = np.flatnonzero(row > kth)
+        ties = np.flatnonzero(row == kth)[:k - len(above)]  # flatnonzero는 인덱스 오름차순
+        idx = np.concatenate([above, ties])
+        ranked[q_idx] = idx[np.lexsort((idx, -row[idx]))]
+    return ranked
+
+def rrf_fuse(ranked_lists, num_docs, k=60, top_n=5):
+    """여러 (쿼리 x K) 순위 행렬을 RRF로 결합해 (쿼리 x top_n) 인덱스 반환"""
+    num_queries = ranked_lists[0].shape[0]
+    fused = np.zeros((num_queries, num_docs), dtype=np.float32)
+    rows = np.arange(num_queries)[:, None]
+    
+    for ranked in ranked_lists:
+        rrf = 1.0 / (k + np.arange(1, ranked.shape[1] + 1, dtype=np.float32))
+        fused[rows, ranked] += rrf  # 한 행 안에서 인덱스가 겹치지 않으므로 바로 누적
+    
+    return top_k_ranked(fused, top_n)
+
+def gt_index_mask(corpus, gt_doc_names):
+    """쿼리별 GT 문서 청크 마스크 (쿼리 x 문서, bool)
+    
+    test_hybrid_bge.py와 같은 규칙: base_doc_name 일치, 없으면 title 일치
+    """
+    base_doc_name = (
+        corpus['document_name'].fillna('').astype(str)
+        .str.rsplit('_chunk', n=1).str[0]
+        .str.replace(r'\.(pdf|xlsx|docx)', '', regex=True)
+        .str.strip()
+    )
+    base_to_idx = corpus.groupby(base_doc_name.values).indices
+    title_to_idx = corpus.groupby(corpus['title'].values).indices
+    
+    mask = np.zeros((len(gt_doc_names), len(corpus)), dtype=bool)
+    for q_idx, gt_doc_name in enumerate(gt_doc_names):
+        gt_base = gt_doc_name.replace('.pdf', '').replace('.xlsx', '').replace('.docx', '').strip()
+        idx = base_to_idx.get(gt_base)
+        if idx is None or not gt_base:
+            idx = title_to_idx.get(gt_doc_name)
+        if idx is not None:
+            mask[q_idx, idx] = True
+    
+    return mask
+
+def retrieval_metrics(top_indices, gt_mask):
+    """Recall@1, Recall@5, MRR (Top-5 기준)"""
+    hits = np.take_along_axis(gt_mask, top_indices[:, :5], axis=1)
+    first_hit = np.where(hits.any(axis=1), hits.argmax(axis=1) + 1, 0)
+    mrr = np.where(first_hit > 0, 1.0 / np.maximum(first_hit, 1), 0.0)
+    return {
+        'recall@1': hits[:, 0].mean(),
+        'recall@5': hits.any(axis=1).mean(),
+        'mrr': mrr.mean()
+    }
+
+def evaluate_hybrid_batch(candidate_k=20, top_n=5, rrf_k=60):
+    """하이브리드 검색 일괄 평가"""
+    print("=" * 80)
+    print("🔄 하이브리드 검색 일괄 평가: BGE-M3 + BM25")
+    print("=" * 80)
+    
+    # 1. 데이터 로드
+    print("\n📦 준비 중...")
+    corpus = load_corpus()
+    print(f"   Corpus: {len(corpus):,}개")
+    
+    doc_embeddings = np.load(EMBEDDINGS_PATH, mmap_mode='r')
+    if len(doc_embeddings) != len(corpus):
+        print(f"❌ 임베딩 행 수({len(doc_embeddings):,})가 corpus({len(corpus):,})와 다릅니다.")
+        print("   regenerate_embeddings.py를 다시 실행하세요.")
+        return None
+    # 저장은 float16, 행렬곱은 float32로 한 번만 변환
+    doc_embeddings = np.asarray(doc_embeddings, dtype=np.float32)
+    
+    gt_df = pd.read_csv(DATA_DIR / "ground_truth_100.csv")
+    gt_df = gt_df[gt_df['rank'] > 0]
+    gt_df = gt_df[gt_df['query'].apply(lambda q: isinstance(q, str))
+                  & gt_df['document_name'].apply(lambda d: isinstance(d, str))]
+    
+    gt_mask = gt_index_mask(corpus, gt_df['document_name'].tolist())
+    has_gt = gt_mask.any(axis=1)
+    gt_df = gt_df[has_gt]
+    gt_mask = gt_mask[has_gt]
+    queries = gt_df['query'].tolist()
+    print(f"   Ground Truth: {len(queries)}개")
+    
+    # 2. 희소 점수 (BM25, 희소 행렬곱 한 번)
+    start = time.time()
+    bm25 = BM25Okapi([text.split() for text in corpus['text']])
+    bm25_matrix, vocab = build_bm25_csr(bm25)
+    sparse_scores = (query_term_matrix(queries, vocab) @ bm25_matrix).toarray()
+    print(f"   BM25 점수 계산: {time.time() - start:.1f}초")
+    
+    # 3. 밀집 점수 (BGE-M3, GEMM 한 번)
+    # 쿼리 임베딩은 디스크 캐시에서 (캐시에 없는 쿼리가 있을 때만 모델 로드)
+    start = time.time()
+    query_embeddings = get_or_encode(
+        queries, lambda: get_embed_model(EMBED_MODEL), default_cache_path(EMBED_MODEL)
+    ).astype(np.float32, copy=False)
+    dense_scores = query_embeddings @ doc_embeddings.T
+    print(f"   벡터 점수 계산: {time.time() - start:.1f}초")
+    
+    # 4. Top-K 순위 + RRF 결합
+    dense_ranked = top_k_ranked(dense_scores, candidate_k)
+    sparse_ranked = top_k_ranked(sparse_scores, candidate_k)
+    hybrid_ranked = rrf_fuse([dense_ranked, sparse_ranked], len(corpus), k=rrf_k, top_n=top_n)
+    
+    # 5. 결과
+    results = {
+        'Baseline (BGE-M3만)': retrieval_metrics(dense_ranked, gt_mask),
+        'BM25만 (키워드)': retrieval_metrics(sparse_ranked, gt_mask),
+        'Hybrid (BGE-M3 + BM25)': retrieval_metrics(hybrid_ranked, gt_mask),
+    }
+    
+    print("\n" + "=" * 80)
+    print("📊 결과")
+    print("=" * 80)
+    print(f"\n평가 쿼리: {len(queries)}개")
+    
+    for name, metrics in results.items():
+        print(f"\n🔹 {name}")
+        print(f"   Recall@1: {metrics['recall@1']:.2%}")
+        print(f"   Recall@5: {metrics['recall@5']:.2%}")
+        print(f"   MRR: {metrics['mrr']:.4f}")
+    
+    return results
+
+if __name__ == "__main__":
+    evaluate_hybrid_batch()
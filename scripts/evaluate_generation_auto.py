@@ -9,27 +9,42 @@ GPT-4를 평가자로 사용하여 4가지 기준으로 자동 채점:
 4. 근거성 (Groundedness)
 """
 
+import asyncio
+import csv
 import pandas as pd
 import sys
 from pathlib import Path
 import warnings
-import time
 import os
 from dotenv import load_dotenv
 warnings.filterwarnings('ignore')
 
+import json
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(PROJECT_ROOT))
 
-from openai import OpenAI
+from eval_context import get_async_openai_client
 
 # .env 파일 로드
 load_dotenv()
 
 DATA_DIR = PROJECT_ROOT / "data"
 
-# OpenAI API 클라이언트 초기화
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# OpenAI API 클라이언트 (평가 요청을 동시에 보내기 위해 비동기 클라이언트, 커넥션 풀 공유)
+client = get_async_openai_client()
+
+# 동시에 진행할 평가 요청 수 (API 속도 제한 고려)
+JUDGE_CONCURRENCY = int(os.getenv('JUDGE_CONCURRENCY', '6'))
+
+# 분당 요청 수 상한 (계정 RPM 한도에 맞춰 설정, 0이면 제한 없음)
+OPENAI_RPM = int(os.getenv('OPENAI_RPM', '0'))
 
 EVALUATION_PROMPT = """당신은 대학 챗봇 답변 품질을 평가하는 전문가입니다.
 
@@ -84,107 +99,246 @@ EVALUATION_PROMPT = """당신은 대학 챗봇 답변 품질을 평가하는 전
 }}
 """
 
-def evaluate_answer(query: str, answer: str, context: str) -> dict:
-    """LLM을 사용하여 답변 평가"""
-    
+def build_judge_request(query: str, answer: str, context: str) -> dict:
+    """평가용 chat.completions 요청 본문 (실시간/Batch API 공용)"""
     prompt = EVALUATION_PROMPT.format(
         query=query,
         answer=answer,
         context=context[:1000]  # 컨텍스트 길이 제한
     )
     
+    return {
+        "model": "gpt-4o-mini",
+        "messages": [
+            {"role": "system", "content": "당신은 객관적인 답변 품질 평가자입니다."},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.1,  # 일관성을 위해 낮게
+        "response_format": {"type": "json_object"}
+    }
+
+def parse_judge_reply(content) -> dict:
+    """평가 모델의 JSON 응답 → 점수 dict"""
+    result = _json_loads(content)
+    
+    return {
+        'accuracy': result.get('accuracy', 0),
+        'relevance': result.get('relevance', 0),
+        'completeness': result.get('completeness', 0),
+        'groundedness': result.get('groundedness', 0),
+        'reasoning': result.get('reasoning', '')
+    }
+
+def failed_result(error) -> dict:
+    """평가 실패 시 0점 결과"""
+    print(f"   ⚠️ 평가 실패: {error}")
+    return {
+        'accuracy': 0,
+        'relevance': 0,
+        'completeness': 0,
+        'groundedness': 0,
+        'reasoning': f'평가 실패: {str(error)}'
+    }
+
+async def evaluate_answer(query: str, answer: str, context: str) -> dict:
+    """LLM을 사용하여 답변 평가"""
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "당신은 객관적인 답변 품질 평가자입니다."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.1,  # 일관성을 위해 낮게
-            response_format={"type": "json_object"}
-        )
-        
-        import json
-        result = json.loads(response.choices[0].message.content)
-        
-        return {
-            'accuracy': result.get('accuracy', 0),
-            'relevance': result.get('relevance', 0),
-            'completeness': result.get('completeness', 0),
-            'groundedness': result.get('groundedness', 0),
-            'reasoning': result.get('reasoning', '')
-        }
+        response = await client.chat.completions.create(**build_judge_request(query, answer, context))
+        return parse_judge_reply(response.choices[0].message.content)
         
     except Exception as e:
-        print(f"   ⚠️ 평가 실패: {e}")
-        return {
-            'accuracy': 0,
-            'relevance': 0,
-            'completeness': 0,
-            'groundedness': 0,
-            'reasoning': f'평가 실패: {str(e)}'
-        }
+        return failed_result(e)
+
+class RateLimiter:
+    """요청 시작 간격을 60/rpm초 이상으로 벌려 RPM 한도를 지키는 비동기 속도 제한기"""
+    
+    def __init__(self, rpm: int):
+        self.interval = 60.0 / rpm if rpm > 0 else 0.0
+        self._lock = asyncio.Lock()
+        self._next_slot = 0.0
+    
+    async def acquire(self):
+        if not self.interval:
+            return
+        
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            if self._next_slot > now:
+                await asyncio.sleep(self._next_slot - now)
+                now = self._next_slot
+            self._next_slot = now + self.interval
+
+RESULT_FIELDS = [
+    'query_id', 'query', 'answer',
+    'accuracy', 'relevance', 'completeness', 'groundedness', 'overall',
+    'reasoning'
+]
+
+def build_result(row, eval_result: dict) -> dict:
+    """샘플 행 + 평가 결과 → 결과 CSV 한 행"""
+    return {
+        'query_id': row['query_id'],
+        'query': row['query'],
+        'answer': row['answer'],
+        'accuracy': eval_result['accuracy'],
+        'relevance': eval_result['relevance'],
+        'completeness': eval_result['completeness'],
+        'groundedness': eval_result['groundedness'],
+        'overall': round(
+            (eval_result['accuracy'] + eval_result['relevance'] + 
+             eval_result['completeness'] + eval_result['groundedness']) / 4, 
+            2
+        ),
+        'reasoning': eval_result['reasoning']
+    }
+
+async def evaluate_all(df: pd.DataFrame, on_result=None) -> list:
+    """모든 샘플을 동시에 평가 (세마포어로 동시 요청 수 제한, 입력 순서 유지)
+
+    on_result(row, eval_result)는 평가가 끝나는 즉시 호출됨 (결과를 바로 디스크에 기록하는 용도)
+    """
+    sem = asyncio.Semaphore(JUDGE_CONCURRENCY)
+    limiter = RateLimiter(OPENAI_RPM)
+    
+    async def one(row):
+        async with sem:
+            await limiter.acquire()
+            eval_result = await evaluate_answer(row['query'], row['answer'], row['top_context'])
+        if on_result is not None:
+            on_result(row, eval_result)
+        return eval_result
+    
+    return await asyncio.gather(*(one(row) for _, row in df.iterrows()))
+
+# Batch API 상태 확인 간격 (초)
+BATCH_POLL_SECONDS = int(os.getenv('BATCH_POLL_SECONDS', '30'))
+
+async def evaluate_all_batch(df: pd.DataFrame, on_result=None) -> list:
+    """OpenAI Batch API(/v1/batches)로 모든 샘플을 한 번에 평가 (실시간 호출 대비 비용 절반, RPM 제한 없음)
+
+    요청 JSONL 업로드 → 배치 생성 → 완료될 때까지 대기 → 결과 파일을 받아 query_id별로 매칭
+    """
+    rows = [row for _, row in df.iterrows()]
+    if not rows:
+        return []
+    
+    lines = [
+        json.dumps({
+            "custom_id": str(row['query_id']),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": build_judge_request(row['query'], row['answer'], row['top_context'])
+        }, ensure_ascii=False)
+        for row in rows
+    ]
+    batch_input = await client.files.create(
+        file=("judge_requests.jsonl", "\n".join(lines).encode("utf-8")),
+        purpose="batch"
+    )
+    batch = await client.batches.create(
+        input_file_id=batch_input.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    print(f"   📤 배치 생성: {batch.id} ({len(rows)}개 요청)")
+    
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(BATCH_POLL_SECONDS)
+        batch = await client.batches.retrieve(batch.id)
+        print(f"   ⏳ 배치 상태: {batch.status} "
+              f"({batch.request_counts.completed}/{batch.request_counts.total})")
+    
+    # custom_id(query_id) → 평가 결과
+    replies = {}
+    if batch.output_file_id:
+        output = await client.files.content(batch.output_file_id)
+        for line in output.content.splitlines():
+            if not line.strip():
+                continue
+            item = _json_loads(line)
+            response = item.get('response') or {}
+            try:
+                if response.get('status_code') != 200:
+                    raise RuntimeError(item.get('error') or response.get('status_code'))
+                content = response['body']['choices'][0]['message']['content']
+                replies[item['custom_id']] = parse_judge_reply(content)
+            except Exception as e:
+                replies[item['custom_id']] = failed_result(e)
+    
+    results = []
+    for row in rows:
+        eval_result = replies.get(str(row['query_id']))
+        if eval_result is None:
+            eval_result = failed_result(f"배치 결과 없음 (status={batch.status})")
+        if on_result is not None:
+            on_result(row, eval_result)
+        results.append(eval_result)
+    
+    return results
 
 def main():
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='LLM 기반 자동 Generation 품질 평가')
+    parser.add_argument('--resume', action='store_true',
+                        help='기존 결과 파일에서 평가가 끝난 query_id는 건너뛰고 이어서 평가')
+    parser.add_argument('--interactive', action='store_true',
+                        help='Batch API 대신 실시간 chat.completions 호출로 평가 (결과를 바로 확인할 때)')
+    args = parser.parse_args()
+    
     print("=" * 80)
     print("🤖 LLM 기반 자동 Generation 품질 평가")
     print("=" * 80)
     
     # 샘플 데이터 로드
-    samples_path = DATA_DIR / "rag_generation_samples.csv"
+    samples_path = DATA_DIR / "rag_generation_samples.jsonl"
     
     if not samples_path.exists():
         print(f"❌ 오류: {samples_path} 파일이 없습니다.")
         print("먼저 evaluate_rag_quantitative.py를 실행하세요.")
         return
     
-    df = pd.read_csv(samples_path)
-    print(f"\n📋 {len(df)}개 샘플 답변 평가 중...\n")
+    df = pd.read_json(samples_path, lines=True)
+    output_path = DATA_DIR / "rag_generation_evaluation_auto.csv"
     
-    results = []
+    # --resume: 이미 성공한 평가는 유지하고 나머지만 다시 평가 (실패 행은 재평가)
+    done = pd.DataFrame(columns=RESULT_FIELDS)
+    if args.resume and output_path.exists():
+        done = pd.read_csv(output_path)
+        done = done[done['overall'] > 0]
+        df = df[~df['query_id'].isin(done['query_id'])]
+        print(f"\n⏩ 이미 평가된 {len(done)}개 샘플 건너뜀")
     
-    for idx, row in df.iterrows():
-        query_id = row['query_id']
-        query = row['query']
-        answer = row['answer']
-        context = row['top_context']
-        
-        print(f"[{query_id}/10] {query[:50]}...")
-        
-        # LLM 평가
-        eval_result = evaluate_answer(query, answer, context)
-        
-        result = {
-            'query_id': query_id,
-            'query': query,
-            'answer': answer,
-            'accuracy': eval_result['accuracy'],
-            'relevance': eval_result['relevance'],
-            'completeness': eval_result['completeness'],
-            'groundedness': eval_result['groundedness'],
-            'overall': round(
-                (eval_result['accuracy'] + eval_result['relevance'] + 
-                 eval_result['completeness'] + eval_result['groundedness']) / 4, 
-                2
-            ),
-            'reasoning': eval_result['reasoning']
-        }
-        
-        results.append(result)
+    print(f"\n📋 {len(df)}개 샘플 답변 평가 중...\n")
+    
+    # 결과는 평가가 끝나는 대로 한 행씩 기록 (중간에 중단돼도 완료분은 보존)
+    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        writer.writerows(done.to_dict('records'))
+        f.flush()
         
-        print(f"   정확성: {eval_result['accuracy']}/5, "
-              f"관련성: {eval_result['relevance']}/5, "
-              f"완성도: {eval_result['completeness']}/5, "
-              f"근거성: {eval_result['groundedness']}/5")
-        print(f"   → Overall: {result['overall']}/5.0")
-        print()
+        def on_result(row, eval_result):
+            result = build_result(row, eval_result)
+            writer.writerow(result)
+            f.flush()
+            
+            print(f"[{result['query_id']}/10] {result['query'][:50]}...")
+            print(f"   정확성: {eval_result['accuracy']}/5, "
+                  f"관련성: {eval_result['relevance']}/5, "
+                  f"완성도: {eval_result['completeness']}/5, "
+                  f"근거성: {eval_result['groundedness']}/5")
+            print(f"   → Overall: {result['overall']}/5.0")
+            print()
         
-        # API 속도 제한 고려
-        time.sleep(1)
+        # LLM 평가: 기본은 Batch API, --interactive면 실시간 동시 호출
+        if args.interactive:
+            asyncio.run(evaluate_all(df, on_result))
+        else:
+            asyncio.run(evaluate_all_batch(df, on_result))
     
-    # 결과 저장
-    results_df = pd.DataFrame(results)
-    output_path = DATA_DIR / "rag_generation_evaluation_auto.csv"
+    # 완료 순서대로 기록되었으므로 query_id 순으로 정렬해 다시 저장
+    results_df = pd.read_csv(output_path).sort_values('query_id').reset_index(drop=True)
     results_df.to_csv(output_path, index=False, encoding='utf-8')
     
     # 통계 계산
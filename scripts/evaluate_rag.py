@@ -10,8 +10,12 @@ RAG 시스템 종합 평가
 """
 
 import pandas as pd
+import hashlib
+import os
+import pickle
 import time
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import warnings
 warnings.filterwarnings('ignore')
@@ -19,9 +23,33 @@ warnings.filterwarnings('ignore')
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(PROJECT_ROOT))
 
-from rag_demo import RAGSystem
+from eval_context import get_rag
 
 DATA_DIR = PROJECT_ROOT / "data"
+CACHE_DIR = DATA_DIR / ".cache"
+
+def _cache_path(kind, *key_parts):
+    """캐시 파일 경로 (키 구성 요소의 sha1 해시)"""
+    key = hashlib.sha1("\x1f".join(map(str, key_parts)).encode("utf-8")).hexdigest()
+    return CACHE_DIR / f"{kind}_{key}.pkl"
+
+def cached_call(kind, key_parts, fn, use_cache=False):
+    """디스크 캐시가 있으면 불러오고, 없으면 fn()을 실행해 저장 → (값, 캐시 적중 여부)"""
+    if not use_cache:
+        return fn(), False
+    
+    path = _cache_path(kind, *key_parts)
+    if path.exists():
+        with open(path, 'rb') as f:
+            return pickle.load(f), True
+    
+    value = fn()
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return value, False
 
 def load_test_queries(query_file="queries_new_30.txt"):
     """테스트 쿼리 로드"""
@@ -36,7 +64,8 @@ def load_test_queries(query_file="queries_new_30.txt"):
     
     return queries
 
-def evaluate_rag_system(top_k=5, num_queries=30, query_file="queries_new_30.txt"):
+def evaluate_rag_system(top_k=5, num_queries=30, query_file="queries_new_30.txt", max_workers=8,
+                        use_cache=False):
     """RAG 시스템 평가"""
     print("=" * 80)
     print("🔬 RAG 시스템 종합 평가 (새로운 쿼리)")
@@ -56,42 +85,47 @@ def evaluate_rag_system(top_k=5, num_queries=30, query_file="queries_new_30.txt"
     
     # RAG 시스템 초기화
     print(f"\n🚀 RAG 시스템 초기화...")
-    rag = RAGSystem(llm_provider='openai', llm_model='gpt-4o-mini')
+    llm_model = 'gpt-4o-mini'
+    rag = get_rag(llm_provider='openai', llm_model=llm_model)
+    collection_name = getattr(rag, 'collection_name', '')
+    if use_cache:
+        # 캐시 키는 (쿼리, top_k, 컬렉션) / (쿼리, 검색 문서, LLM 모델)뿐이라
+        # 같은 컬렉션에 다시 적재하거나 프롬프트/생성 파라미터를 바꿔도 이전 결과가 그대로 나옴
+        print(f"   💾 검색/생성 결과 캐시 사용: {CACHE_DIR} (--cache)")
+        print(f"      ⚠️  코퍼스 재적재·프롬프트 변경은 캐시 키에 반영되지 않음 → 바꾼 뒤에는 캐시 없이 실행")
+        print(f"      캐시에서 불러온 쿼리는 응답 시간을 측정하지 않음 (응답 시간 통계에서 제외)")
     
     # 평가 시작
     print(f"\n{'=' * 80}")
-    print(f"📊 평가 진행 중... (Top-{top_k})")
+    print(f"📊 평가 진행 중... (Top-{top_k}, 동시 처리 {max_workers}개)")
     print(f"{'=' * 80}\n")
     
-    results = []
-    errors = []
-    retrieval_times = []
-    generation_times = []
-    total_times = []
-    
-    for i, query in enumerate(queries, 1):
+    def run_one(i, query):
+        """쿼리 하나 처리 (워커 스레드에서 실행) → (결과, 오류 또는 None)"""
         try:
-            # 진행 상황 출력
-            if i % 10 == 0:
-                print(f"   진행: {i}/{len(queries)}... ({i/len(queries)*100:.0f}%)")
-            
-            # 전체 시간 측정 시작
-            start_total = time.time()
+            # 전체 시간 측정 시작 (스레드별 측정이므로 perf_counter 사용)
+            start_total = time.perf_counter()
             
             # 1. 검색 단계
-            start_retrieval = time.time()
-            contexts = rag.retrieve(query, top_k=top_k)
-            retrieval_time = time.time() - start_retrieval
+            start_retrieval = time.perf_counter()
+            contexts, retrieval_cached = cached_call(
+                'retrieve', (query, top_k, collection_name),
+                lambda: rag.retrieve(query, top_k=top_k), use_cache
+            )
+            retrieval_time = time.perf_counter() - start_retrieval
             
             # 2. 생성 단계
-            start_generation = time.time()
-            answer = rag.generate(query, contexts)
-            generation_time = time.time() - start_generation
+            start_generation = time.perf_counter()
+            context_ids = tuple(c.get('id', c.get('title', '')) for c in contexts)
+            answer, generation_cached = cached_call(
+                'generate', (query, context_ids, llm_model),
+                lambda: rag.generate(query, contexts), use_cache
+            )
+            generation_time = time.perf_counter() - start_generation
             
-            total_time = time.time() - start_total
+            total_time = time.perf_counter() - start_total
             
-            # 결과 저장
-            results.append({
+            return {
                 'query_id': i,
                 'query': query,
                 'answer': answer,
@@ -100,25 +134,16 @@ def evaluate_rag_system(top_k=5, num_queries=30, query_file="queries_new_30.txt"
                 'retrieval_time_ms': retrieval_time * 1000,
                 'generation_time_ms': generation_time * 1000,
                 'total_time_ms': total_time * 1000,
+                'cached': retrieval_cached or generation_cached,  # 캐시 적중 시 시간은 실제 지연이 아님
                 'success': True,
                 'top_title': contexts[0]['title'] if contexts else ''
-            })
-            
-            retrieval_times.append(retrieval_time * 1000)
-            generation_times.append(generation_time * 1000)
-            total_times.append(total_time * 1000)
+            }, None
             
         except Exception as e:
             print(f"\n⚠️  쿼리 {i} 실패: {query[:50]}...")
             print(f"    오류: {str(e)}")
             
-            errors.append({
-                'query_id': i,
-                'query': query,
-                'error': str(e)
-            })
-            
-            results.append({
+            return {
                 'query_id': i,
                 'query': query,
                 'answer': None,
@@ -127,9 +152,38 @@ def evaluate_rag_system(top_k=5, num_queries=30, query_file="queries_new_30.txt"
                 'retrieval_time_ms': 0,
                 'generation_time_ms': 0,
                 'total_time_ms': 0,
+                'cached': False,
                 'success': False,
                 'top_title': ''
-            })
+            }, {
+                'query_id': i,
+                'query': query,
+                'error': str(e)
+            }
+    
+    # OpenAI 호출 대기 시간이 대부분이므로 스레드로 쿼리들을 동시에 처리
+    # RAGSystem 하나를 스레드끼리 공유: rag_demo.py(이 저장소 밖)의 retrieve/generate는
+    # 호출마다 인스턴스 상태를 바꾸지 않고 임베딩 모델(추론만)과 Qdrant/OpenAI 클라이언트
+    # (httpx 커넥션 풀, 스레드 안전)만 읽어 씀 → app.py가 Flask 요청 스레드들에서
+    # 같은 인스턴스를 공유하는 것과 같은 전제. 이 전제가 깨지면 --workers 1로 실행
+    results_by_id = {}
+    errors_by_id = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_one, i, query) for i, query in enumerate(queries, 1)]
+        
+        for done, future in enumerate(as_completed(futures), 1):
+            result, error = future.result()
+            results_by_id[result['query_id']] = result
+            if error:
+                errors_by_id[error['query_id']] = error
+            
+            # 진행 상황 출력
+            if done % 10 == 0:
+                print(f"   진행: {done}/{len(queries)}... ({done/len(queries)*100:.0f}%)")
+    
+    # 원래 쿼리 순서로 정렬
+    results = [results_by_id[i] for i in sorted(results_by_id)]
+    errors = [errors_by_id[i] for i in sorted(errors_by_id)]
     
     # 결과 저장
     results_df = pd.DataFrame(results)
@@ -154,25 +208,38 @@ def evaluate_rag_system(top_k=5, num_queries=30, query_file="queries_new_30.txt"
     print(f"   성공: {len(successful)}개 ({len(successful)/len(results_df)*100:.1f}%)")
     print(f"   실패: {len(errors)}개 ({len(errors)/len(results_df)*100:.1f}%)")
     
+    # 응답 시간은 캐시를 쓰지 않고 실제로 실행한 쿼리만 집계 (캐시 적중은 unpickle 시간일 뿐)
+    timed = successful[~successful['cached'].astype(bool)]
+    num_cached = len(successful) - len(timed)
+    
     if len(successful) > 0:
-        print(f"\n⏱️  응답 시간 (성공한 쿼리):")
-        print(f"   검색 시간:")
-        print(f"      평균: {successful['retrieval_time_ms'].mean():.1f}ms")
-        print(f"      중앙값: {successful['retrieval_time_ms'].median():.1f}ms")
-        print(f"      최소: {successful['retrieval_time_ms'].min():.1f}ms")
-        print(f"      최대: {successful['retrieval_time_ms'].max():.1f}ms")
-        
-        print(f"\n   생성 시간:")
-        print(f"      평균: {successful['generation_time_ms'].mean():.1f}ms")
-        print(f"      중앙값: {successful['generation_time_ms'].median():.1f}ms")
-        print(f"      최소: {successful['generation_time_ms'].min():.1f}ms")
-        print(f"      최대: {successful['generation_time_ms'].max():.1f}ms")
-        
-        print(f"\n   전체 시간:")
-        print(f"      평균: {successful['total_time_ms'].mean():.1f}ms")
-        print(f"      중앙값: {successful['total_time_ms'].median():.1f}ms")
-        print(f"      최소: {successful['total_time_ms'].min():.1f}ms")
-        print(f"      최대: {successful['total_time_ms'].max():.1f}ms")
+        print(f"\n⏱️  응답 시간 (성공 + 캐시 미사용 쿼리 {len(timed)}개, 캐시 적중 {num_cached}개 제외):")
+        print(f"   동시 처리 {max_workers}개 상태에서 측정", end='')
+        if max_workers > 1:
+            # 여러 쿼리가 같은 임베딩 모델/HTTP 풀을 두고 경쟁 → 대기 시간이 포함됨
+            print(f" (대기 시간 포함, 단일 쿼리 지연은 --workers 1로 측정)")
+        else:
+            print(f" (단일 쿼리 지연)")
+        if len(timed) == 0:
+            print(f"   N/A (cached) - 모든 쿼리가 캐시 적중 (--cache 없이 다시 측정)")
+        else:
+            print(f"   검색 시간:")
+            print(f"      평균: {timed['retrieval_time_ms'].mean():.1f}ms")
+            print(f"      중앙값: {timed['retrieval_time_ms'].median():.1f}ms")
+            print(f"      최소: {timed['retrieval_time_ms'].min():.1f}ms")
+            print(f"      최대: {timed['retrieval_time_ms'].max():.1f}ms")
+            
+            print(f"\n   생성 시간:")
+            print(f"      평균: {timed['generation_time_ms'].mean():.1f}ms")
+            print(f"      중앙값: {timed['generation_time_ms'].median():.1f}ms")
+            print(f"      최소: {timed['generation_time_ms'].min():.1f}ms")
+            print(f"      최대: {timed['generation_time_ms'].max():.1f}ms")
+            
+            print(f"\n   전체 시간:")
+            print(f"      평균: {timed['total_time_ms'].mean():.1f}ms")
+            print(f"      중앙값: {timed['total_time_ms'].median():.1f}ms")
+            print(f"      최소: {timed['total_time_ms'].min():.1f}ms")
+            print(f"      최대: {timed['total_time_ms'].max():.1f}ms")
         
         print(f"\n🔍 검색 품질:")
         print(f"   평균 Top-1 유사도: {successful['top_score'].mean():.3f}")
@@ -191,7 +258,8 @@ def evaluate_rag_system(top_k=5, num_queries=30, query_file="queries_new_30.txt"
         print(f"답변: {row['answer'][:200]}...")
         print(f"검색 문서: {row['top_title']}")
         print(f"유사도: {row['top_score']:.3f}")
-        print(f"응답 시간: {row['total_time_ms']:.0f}ms")
+        total_time = 'N/A (cached)' if row['cached'] else f"{row['total_time_ms']:.0f}ms"
+        print(f"응답 시간: {total_time}")
     
     # 저성능 쿼리 (유사도 낮음)
     if len(successful) > 0:
@@ -207,13 +275,16 @@ def evaluate_rag_system(top_k=5, num_queries=30, query_file="queries_new_30.txt"
                 print(f"유사도: {row['top_score']:.3f}")
                 print(f"검색 문서: {row['top_title']}")
     
-    # 긴 응답 시간 쿼리
+    # 긴 응답 시간 쿼리 (캐시 미사용 쿼리만)
     if len(successful) > 0:
-        slow_queries = successful.nlargest(5, 'total_time_ms')
+        slow_queries = timed.nlargest(5, 'total_time_ms')
         print(f"\n{'=' * 80}")
-        print(f"🐌 느린 응답 쿼리 (Top 5)")
+        print(f"🐌 느린 응답 쿼리 (Top 5, 동시 처리 {max_workers}개 상태에서 측정)")
         print(f"{'=' * 80}")
         
+        if len(timed) == 0:
+            print(f"\n   N/A (cached) - 모든 쿼리가 캐시 적중")
+        
         for i, row in slow_queries.iterrows():
             print(f"\n[쿼리 {row['query_id']}] {row['query']}")
             print(f"응답 시간: {row['total_time_ms']:.0f}ms")
@@ -240,9 +311,14 @@ def main():
     parser.add_argument('--top-k', type=int, default=5, help='검색할 문서 수')
     parser.add_argument('--num-queries', type=int, default=30, help='평가할 쿼리 수')
     parser.add_argument('--query-file', type=str, default='queries_new_30.txt', help='쿼리 파일명')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='동시에 처리할 쿼리 수 (응답 시간은 동시 처리 부하 포함, 1이면 단일 쿼리 지연)')
+    parser.add_argument('--cache', action='store_true',
+                        help='검색/생성 결과 디스크 캐시 사용 (코퍼스/프롬프트 변경은 감지하지 못함)')
     args = parser.parse_args()
     
-    evaluate_rag_system(top_k=args.top_k, num_queries=args.num_queries, query_file=args.query_file)
+    evaluate_rag_system(top_k=args.top_k, num_queries=args.num_queries, query_file=args.query_file,
+                        max_workers=args.workers, use_cache=args.cache)
 
 if __name__ == "__main__":
     main()
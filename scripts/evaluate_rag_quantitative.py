@@ -6,6 +6,7 @@ RAG 시스템 정량적 평가
 2. Generation 품질: 정확성, 관련성, 완성도, 근거성 (수동 평가용 샘플)
 """
 
+import json
 import pandas as pd
 import numpy as np
 import sys
@@ -16,14 +17,14 @@ warnings.filterwarnings('ignore')
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(PROJECT_ROOT))
 
-from rag_demo import RAGSystem
+from eval_context import get_rag
 
 DATA_DIR = PROJECT_ROOT / "data"
 
 def load_ground_truth():
     """Ground Truth 로드"""
     gt_path = DATA_DIR / "ground_truth_100.csv"
-    gt_df = pd.read_csv(gt_path)
+    gt_df = pd.read_csv(gt_path, usecols=['query', 'document_name', 'rank'])
     
     # rank > 0인 것만 (정답 있는 것)
     gt_valid = gt_df[gt_df['rank'] > 0].copy()
@@ -43,27 +44,32 @@ def evaluate_retrieval():
     
     # RAG 시스템 초기화 (Retrieval만)
     print(f"\n🚀 RAG 시스템 초기화...")
-    rag = RAGSystem(llm_provider='openai', llm_model='gpt-4o-mini')
+    rag = get_rag(llm_provider='openai', llm_model='gpt-4o-mini')
     
     # Corpus 로드
     print(f"\n📚 Corpus 로드...")
-    corpus = pd.read_csv(DATA_DIR / "corpus_all.csv")
+    # 매핑에는 document_name/title만 필요 (text 등 큰 컬럼은 읽지 않음)
+    corpus = pd.read_csv(
+        DATA_DIR / "corpus_all.csv",
+        usecols=['document_name', 'title'],
+        dtype={'document_name': str, 'title': str}
+    )
     
-    # Document name → indices 매핑
-    doc_name_to_idx = {}
-    for idx, row in corpus.iterrows():
-        # document_name 우선
-        if pd.notna(row.get('document_name')) and row['document_name']:
-            doc_name = row['document_name']
-            if doc_name not in doc_name_to_idx:
-                doc_name_to_idx[doc_name] = []
-            doc_name_to_idx[doc_name].append(idx)
-        # title 대체
-        elif pd.notna(row.get('title')) and row['title']:
-            title = row['title']
-            if title not in doc_name_to_idx:
-                doc_name_to_idx[title] = []
-            doc_name_to_idx[title].append(idx)
+    # Document name → indices 매핑 (document_name 우선, 없으면 title 대체)
+    has_doc_name = corpus['document_name'].notna() & corpus['document_name'].astype(bool)
+    has_title = corpus['title'].notna() & corpus['title'].astype(bool)
+    name_key = corpus['document_name'].where(has_doc_name, corpus['title'].where(has_title))
+    doc_name_to_idx = name_key.groupby(name_key).indices
+    
+    # GT 매칭용 base_doc_name (chunk 접미사·확장자 제거)은 쿼리마다가 아니라 한 번만 계산
+    base_doc_name = (
+        corpus['document_name'].fillna('').astype(str)
+        .str.rsplit('_chunk', n=1).str[0]
+        .str.replace(r'\.(pdf|xlsx|docx)', '', regex=True)
+        .str.strip()
+    )
+    base_to_idx = corpus.groupby(base_doc_name.values).indices
+    title_to_idx = corpus.groupby('title').indices
     
     print(f"   ✅ {len(corpus):,}개 문서")
     
@@ -72,83 +78,85 @@ def evaluate_retrieval():
     print("🔍 Retrieval 성능 평가")
     print("=" * 80)
     
-    recall_at_1 = []
-    recall_at_3 = []
-    recall_at_5 = []
-    mrr_scores = []
+    # 평가 가능한 쿼리 수의 상한(len(gt_df))으로 미리 할당하고 마지막에 evaluated까지만 사용
+    recall_at_1 = np.zeros(len(gt_df), dtype=np.float32)
+    recall_at_3 = np.zeros(len(gt_df), dtype=np.float32)
+    recall_at_5 = np.zeros(len(gt_df), dtype=np.float32)
+    mrr_scores = np.zeros(len(gt_df), dtype=np.float32)
     
     generation_results = []  # LLM 답변 샘플 저장
+    gen_path = DATA_DIR / "rag_generation_samples.jsonl"
+    
+    # 같은 쿼리가 GT 문서마다 여러 행으로 반복되므로 쿼리별 검색 결과 재사용 (재임베딩/재검색 방지)
+    contexts_cache = {}
     
     evaluated = 0
     
-    for _, row in gt_df.iterrows():
-        query = row['query']
-        gt_doc_name = row['document_name']
-        
-        if not isinstance(query, str) or not isinstance(gt_doc_name, str):
-            continue
-        
-        # GT 인덱스 찾기
-        gt_base = gt_doc_name.replace('.pdf', '').replace('.xlsx', '').replace('.docx', '').strip()
-        
-        # 1. base_doc_name으로 매칭
-        corpus['base_doc_name'] = corpus['document_name'].fillna('').apply(
-            lambda x: x.rsplit('_chunk', 1)[0].replace('.pdf', '').replace('.xlsx', '').replace('.docx', '').strip() if x else ''
-        )
-        gt_indices = set(corpus[corpus['base_doc_name'] == gt_base].index.tolist())
-        
-        # 2. title로 매칭
-        if not gt_indices:
-            gt_indices = set(corpus[corpus['title'] == gt_doc_name].index.tolist())
-        
-        if not gt_indices:
-            continue
-        
-        # Retrieval
-        contexts = rag.retrieve(query, top_k=5)
-        
-        # 검색된 문서의 인덱스 찾기
-        retrieved_indices = []
-        for ctx in contexts:
-            doc_name = ctx.get('title', '')
-            if doc_name in doc_name_to_idx:
-                # 첫 번째 인덱스만 사용
-                retrieved_indices.append(doc_name_to_idx[doc_name][0])
-        
-        # Recall 계산
-        found_at_1 = any(idx in gt_indices for idx in retrieved_indices[:1])
-        found_at_3 = any(idx in gt_indices for idx in retrieved_indices[:3])
-        found_at_5 = any(idx in gt_indices for idx in retrieved_indices[:5])
-        
-        recall_at_1.append(1.0 if found_at_1 else 0.0)
-        recall_at_3.append(1.0 if found_at_3 else 0.0)
-        recall_at_5.append(1.0 if found_at_5 else 0.0)
-        
-        # MRR 계산
-        rank = 0
-        for i, idx in enumerate(retrieved_indices[:5], 1):
-            if idx in gt_indices:
-                rank = i
-                break
-        mrr_scores.append(1.0 / rank if rank > 0 else 0.0)
-        
-        evaluated += 1
-        
-        # 진행 상황
-        if evaluated % 10 == 0:
-            print(f"   진행: {evaluated}/{len(gt_df)}...")
-        
-        # 처음 10개는 LLM 답변도 생성 (수동 평가용)
-        if evaluated <= 10:
-            answer = rag.generate(query, contexts)
-            generation_results.append({
-                'query_id': evaluated,
-                'query': query,
-                'answer': answer,
-                'top_context': contexts[0]['text'][:200] if contexts else '',
-                'found_in_top1': found_at_1,
-                'found_in_top5': found_at_5
-            })
+    # 답변 샘플은 생성될 때마다 JSONL로 바로 기록 (중간에 중단돼도 생성된 답변은 보존)
+    # 루프에서 예외가 나도 with 블록이 파일을 닫음
+    with gen_path.open('w', encoding='utf-8') as gen_file:
+        for row in gt_df.itertuples(index=False):
+            query = row.query
+            gt_doc_name = row.document_name
+            
+            if not isinstance(query, str) or not isinstance(gt_doc_name, str):
+                continue
+            
+            # GT 인덱스 찾기
+            gt_base = gt_doc_name.replace('.pdf', '').replace('.xlsx', '').replace('.docx', '').strip()
+            
+            # 1. base_doc_name으로 매칭, 2. 없으면 title로 매칭
+            gt_indices = frozenset(base_to_idx.get(gt_base, ())) or frozenset(title_to_idx.get(gt_doc_name, ()))
+            
+            if not gt_indices:
+                continue
+            
+            # Retrieval (고유 쿼리당 한 번)
+            contexts = contexts_cache.get(query)
+            if contexts is None:
+                contexts = contexts_cache[query] = rag.retrieve(query, top_k=5)
+            
+            # 검색된 문서의 인덱스 찾기
+            retrieved_indices = []
+            for ctx in contexts:
+                doc_name = ctx.get('title', '')
+                if doc_name in doc_name_to_idx:
+                    # 첫 번째 인덱스만 사용
+                    retrieved_indices.append(doc_name_to_idx[doc_name][0])
+            
+            # 첫 정답 순위 (1부터, 없으면 0) - set 조회로 한 번만 찾고 Recall/MRR 모두 여기서 계산
+            rank = next((i for i, idx in enumerate(retrieved_indices[:5], 1) if idx in gt_indices), 0)
+            found_at_1 = rank == 1
+            found_at_3 = 0 < rank <= 3
+            found_at_5 = 0 < rank <= 5
+            
+            recall_at_1[evaluated] = found_at_1
+            recall_at_3[evaluated] = found_at_3
+            recall_at_5[evaluated] = found_at_5
+            
+            # MRR 계산
+            mrr_scores[evaluated] = 1.0 / rank if rank > 0 else 0.0
+            
+            evaluated += 1
+            
+            # 진행 상황
+            if evaluated % 10 == 0:
+                print(f"   진행: {evaluated}/{len(gt_df)}...")
+            
+            # 처음 10개는 LLM 답변도 생성 (수동 평가용)
+            if evaluated <= 10:
+                answer = rag.generate(query, contexts)
+                sample = {
+                    'query_id': evaluated,
+                    'query': query,
+                    'answer': answer,
+                    'top_context': contexts[0]['text'][:200] if contexts else '',
+                    'found_in_top1': found_at_1,
+                    'found_in_top5': found_at_5
+                }
+                generation_results.append(sample)
+                gen_file.write(json.dumps(sample, ensure_ascii=False) + '\n')
+                gen_file.flush()
     
     # 결과 출력
     print("\n" + "=" * 80)
@@ -157,10 +165,10 @@ def evaluate_retrieval():
     
     print(f"\n평가 쿼리: {evaluated}개\n")
     
-    recall_1 = np.mean(recall_at_1)
-    recall_3 = np.mean(recall_at_3)
-    recall_5 = np.mean(recall_at_5)
-    mrr = np.mean(mrr_scores)
+    recall_1 = float(recall_at_1[:evaluated].mean())
+    recall_3 = float(recall_at_3[:evaluated].mean())
+    recall_5 = float(recall_at_5[:evaluated].mean())
+    mrr = float(mrr_scores[:evaluated].mean())
     
     print("🔍 Retrieval 성능:")
     print(f"   Top-1 정확도: {recall_1:.1%} (1위에서 정답 찾기)")
@@ -179,12 +187,8 @@ def evaluate_retrieval():
     else:
         print(f"   Top-5: ⭐⭐ 개선 필요 ({recall_5:.1%})")
     
-    # Generation 샘플 저장
+    # Generation 샘플 안내 (파일은 루프에서 이미 기록됨)
     if generation_results:
-        gen_df = pd.DataFrame(generation_results)
-        gen_path = DATA_DIR / "rag_generation_samples.csv"
-        gen_df.to_csv(gen_path, index=False, encoding='utf-8')
-        
         print("\n" + "=" * 80)
         print("💬 Generation 품질 평가 (수동)")
         print("=" * 80)
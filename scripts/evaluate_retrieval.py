@@ -4,17 +4,19 @@
 새로운 청킹된 컬렉션(kit_corpus_bge_all) 테스트
 """
 
-import csv
-import sys
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
+import numpy as np
+import pandas as pd
+import torch
 from qdrant_client import QdrantClient
+from qdrant_client.http import models as qm
 from sentence_transformers import SentenceTransformer
 import warnings
 warnings.filterwarnings('ignore')
 
-# CSV 필드 크기 제한 해제
-csv.field_size_limit(sys.maxsize)
-
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 DATA_DIR = PROJECT_ROOT / "data"
 
@@ -22,39 +24,57 @@ DATA_DIR = PROJECT_ROOT / "data"
 COLLECTION_NAME = "kit_corpus_bge_all"
 QDRANT_URL = "http://localhost:6333"
 
-def match_document(retrieved_doc, ground_truth_doc):
-    """문서 매칭: document_name 또는 title 기준"""
-    # 정확히 일치
-    if retrieved_doc == ground_truth_doc:
-        return True
-    
-    # _chunk 제거 후 비교 (청킹된 문서 대응)
-    retrieved_base = retrieved_doc.replace('_chunk0', '').replace('_chunk1', '').replace('_chunk2', '').replace('_chunk3', '').replace('_chunk4', '').replace('_chunk5', '').replace('_chunk6', '').replace('_chunk7', '').replace('_chunk8', '').replace('_chunk9', '')
-    for i in range(10, 100):
-        retrieved_base = retrieved_base.replace(f'_chunk{i}', '')
-    
-    if retrieved_base == ground_truth_doc:
-        return True
-    
-    return False
+# 청크 접미사 (예: "버스.pdf_chunk12" → "버스.pdf")
+_CHUNK_RE = re.compile(r'_chunk\d+$')
+# 파일 확장자 (예: "버스.pdf" → "버스")
+_EXT_RE = re.compile(r'\.(pdf|xlsx|docx)$', re.IGNORECASE)
+
+@lru_cache(maxsize=8192)
+def normalize_doc_name(doc_name):
+    """문서 이름 정규화: _chunk 접미사·확장자 제거 (청킹된 문서, 확장자 유무 차이 대응)"""
+    return _EXT_RE.sub('', _CHUNK_RE.sub('', doc_name)).strip()
 
-def calculate_recall_at_k(retrieved_docs, ground_truth_doc, k):
-    """Recall@K 계산 (청킹 문서 대응)"""
-    top_k = retrieved_docs[:k]
-    for doc in top_k:
-        if match_document(doc, ground_truth_doc):
-            return 1.0
-    return 0.0
+def first_match_rank(retrieved_docs, ground_truth_doc):
+    """첫 정답 순위 (1부터, 없으면 0) - 찾는 즉시 중단, Recall@K/MRR 모두 이 값으로 계산
+    
+    retrieved_docs, ground_truth_doc 모두 normalize_doc_name으로 정규화된 이름
+    """
+    return next(
+        (rank for rank, doc in enumerate(retrieved_docs, 1) if doc == ground_truth_doc),
+        0
+    )
+
+def calculate_recall_at_k(rank, k):
+    """Recall@K 계산 (rank: first_match_rank 결과)"""
+    return 1.0 if 0 < rank <= k else 0.0
+
+def calculate_mrr(rank):
+    """MRR (Mean Reciprocal Rank) 계산 (rank: first_match_rank 결과)"""
+    return 1.0 / rank if rank else 0.0
+
+def search_all(client, collection_name, query_vectors, top_k=10, chunk_size=64):
+    """여러 쿼리를 search_batch로 묶어서 검색 (쿼리마다 왕복하지 않도록)"""
+    results = []
+    for start in range(0, len(query_vectors), chunk_size):
+        requests = [
+            qm.SearchRequest(vector=vec.tolist(), limit=top_k, with_payload=True)
+            for vec in query_vectors[start:start + chunk_size]
+        ]
+        results.extend(client.search_batch(collection_name=collection_name, requests=requests))
+    
+    return results
 
-def calculate_mrr(retrieved_docs, ground_truth_doc):
-    """MRR (Mean Reciprocal Rank) 계산 (청킹 문서 대응)"""
-    for rank, doc in enumerate(retrieved_docs, 1):
-        if match_document(doc, ground_truth_doc):
-            return 1.0 / rank
-    return 0.0
+def load_model():
+    """BGE-M3 모델 로드 (GPU가 있으면 fp16으로 올려 인코딩 속도/메모리 개선)"""
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    print(f"\n🤖 BGE-M3 모델 로드 중... (디바이스: {device})")
+    model = SentenceTransformer('BAAI/bge-m3', device=device)
+    if device == 'cuda':
+        model.half()
+    return model
 
-def evaluate_on_dataset(queries_file, ground_truth_file, collection_name):
-    """데이터셋에 대한 검색 성능 평가"""
+def load_dataset(queries_file, ground_truth_file):
+    """쿼리/정답 로드 → (정답이 있는 쿼리 목록, {쿼리: 정규화된 정답 문서 이름})"""
     
     print(f"\n📂 데이터 로드:")
     print(f"   쿼리: {queries_file.name}")
@@ -64,78 +84,83 @@ def evaluate_on_dataset(queries_file, ground_truth_file, collection_name):
     with queries_file.open('r', encoding='utf-8') as f:
         queries = [line.strip() for line in f if line.strip()]
     
-    # Ground truth 로드
-    ground_truth = {}
-    with ground_truth_file.open('r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            query = row['query']
-            doc_name = row['document_name']
-            ground_truth[query] = doc_name
+    # Ground truth 로드 (필요한 두 컬럼만 읽고 행마다 dict를 만들지 않고 zip으로 구성)
+    gt = pd.read_csv(
+        ground_truth_file,
+        usecols=['query', 'document_name'],
+        dtype=str,
+        keep_default_na=False,
+        encoding='utf-8'
+    )
+    # 정답 문서 이름은 로드 시 한 번만 정규화 (평가 루프에서는 == 비교만)
+    ground_truth = {
+        query: normalize_doc_name(doc_name)
+        for query, doc_name in zip(gt['query'].to_numpy(), gt['document_name'].to_numpy())
+    }
     
     print(f"   쿼리 수: {len(queries)}개")
     print(f"   정답 수: {len(ground_truth)}개")
     
-    # Qdrant 연결
-    client = QdrantClient(QDRANT_URL)
-    
-    # BGE-M3 모델 로드
-    print(f"\n🤖 BGE-M3 모델 로드 중...")
-    model = SentenceTransformer('BAAI/bge-m3')
-    
-    # 평가
-    print(f"\n🔍 검색 평가 중...")
-    
-    recall_at_1 = []
-    recall_at_3 = []
-    recall_at_5 = []
-    recall_at_10 = []
-    mrr_scores = []
-    
     queries_with_gt = [q for q in queries if q in ground_truth]
-    
-    for i, query in enumerate(queries_with_gt, 1):
+    return queries_with_gt, ground_truth
+
+def encode_queries(model, queries):
+    """쿼리 임베딩 일괄 생성 (쿼리마다 batch=1로 인코딩하지 않도록)"""
+    return model.encode(
+        queries,
+        batch_size=64,
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+        show_progress_bar=False
+    )
+
+def score_dataset(queries_with_gt, ground_truth, all_results, name=''):
+    """검색 결과로 Recall@K, MRR 계산"""
+    print(f"\n🔍 검색 평가 중... {name}")
+    
+    # 쿼리 수를 알고 있으므로 결과 배열을 미리 할당
+    n = len(queries_with_gt)
+    recall_at_1 = np.zeros(n, dtype=np.float32)
+    recall_at_3 = np.zeros(n, dtype=np.float32)
+    recall_at_5 = np.zeros(n, dtype=np.float32)
+    recall_at_10 = np.zeros(n, dtype=np.float32)
+    mrr_scores = np.zeros(n, dtype=np.float32)
+    
+    for i, (query, results) in enumerate(zip(queries_with_gt, all_results), 1):
         if i % 20 == 0:
             print(f"   진행: {i}/{len(queries_with_gt)}")
         
         gt_doc = ground_truth[query]
         
-        # 쿼리 임베딩
-        query_vector = model.encode(query, normalize_embeddings=True).tolist()
-        
-        # 검색 (Top-10)
-        results = client.search(
-            collection_name=collection_name,
-            query_vector=query_vector,
-            limit=10
-        )
-        
         # 검색된 문서 이름 리스트 (document_name과 title 모두 사용)
         retrieved_docs = []
         for hit in results:
             doc_name = hit.payload.get('document_name', '')
             title = hit.payload.get('title', '')
             # 둘 다 추가 (매칭 가능성 높이기)
-            retrieved_docs.append(doc_name)
+            retrieved_docs.append(normalize_doc_name(doc_name))
             if title and title != doc_name:
-                retrieved_docs.append(title)
+                retrieved_docs.append(normalize_doc_name(title))
+        
+        # 첫 정답 순위 (한 번만 계산)
+        rank = first_match_rank(retrieved_docs, gt_doc)
         
         # Recall@K 계산
-        recall_at_1.append(calculate_recall_at_k(retrieved_docs, gt_doc, 1))
-        recall_at_3.append(calculate_recall_at_k(retrieved_docs, gt_doc, 3))
-        recall_at_5.append(calculate_recall_at_k(retrieved_docs, gt_doc, 5))
-        recall_at_10.append(calculate_recall_at_k(retrieved_docs, gt_doc, 10))
+        recall_at_1[i - 1] = calculate_recall_at_k(rank, 1)
+        recall_at_3[i - 1] = calculate_recall_at_k(rank, 3)
+        recall_at_5[i - 1] = calculate_recall_at_k(rank, 5)
+        recall_at_10[i - 1] = calculate_recall_at_k(rank, 10)
         
         # MRR 계산
-        mrr_scores.append(calculate_mrr(retrieved_docs, gt_doc))
+        mrr_scores[i - 1] = calculate_mrr(rank)
     
     # 결과 계산
     results = {
-        'recall@1': sum(recall_at_1) / len(recall_at_1) * 100 if recall_at_1 else 0,
-        'recall@3': sum(recall_at_3) / len(recall_at_3) * 100 if recall_at_3 else 0,
-        'recall@5': sum(recall_at_5) / len(recall_at_5) * 100 if recall_at_5 else 0,
-        'recall@10': sum(recall_at_10) / len(recall_at_10) * 100 if recall_at_10 else 0,
-        'mrr': sum(mrr_scores) / len(mrr_scores) if mrr_scores else 0,
+        'recall@1': float(recall_at_1.mean()) * 100 if n else 0,
+        'recall@3': float(recall_at_3.mean()) * 100 if n else 0,
+        'recall@5': float(recall_at_5.mean()) * 100 if n else 0,
+        'recall@10': float(recall_at_10.mean()) * 100 if n else 0,
+        'mrr': float(mrr_scores.mean()) if n else 0,
         'total_queries': len(queries_with_gt)
     }
     
@@ -151,59 +176,55 @@ def main():
     print(f"   - 청크 크기: 1000자 (오버랩 150자)")
     print(f"   - 필터링: 차례/목차/참고문헌 제거")
     
-    # 1. Dev 셋 평가
-    print("\n" + "=" * 80)
-    print("1️⃣ Dev Set 평가 (70개 쿼리)")
-    print("=" * 80)
-    
-    dev_results = evaluate_on_dataset(
-        DATA_DIR / "queries_dev.txt",
-        DATA_DIR / "ground_truth_dev.csv",
-        COLLECTION_NAME
-    )
-    
-    print(f"\n📊 결과:")
-    print(f"   Recall@1:  {dev_results['recall@1']:.2f}%")
-    print(f"   Recall@3:  {dev_results['recall@3']:.2f}%")
-    print(f"   Recall@5:  {dev_results['recall@5']:.2f}%")
-    print(f"   Recall@10: {dev_results['recall@10']:.2f}%")
-    print(f"   MRR:       {dev_results['mrr']:.4f}")
-    
-    # 2. Test 셋 평가
-    print("\n" + "=" * 80)
-    print("2️⃣ Test Set 평가 (31개 쿼리)")
-    print("=" * 80)
-    
-    test_results = evaluate_on_dataset(
-        DATA_DIR / "queries_test.txt",
-        DATA_DIR / "ground_truth_test.csv",
-        COLLECTION_NAME
-    )
-    
-    print(f"\n📊 결과:")
-    print(f"   Recall@1:  {test_results['recall@1']:.2f}%")
-    print(f"   Recall@3:  {test_results['recall@3']:.2f}%")
-    print(f"   Recall@5:  {test_results['recall@5']:.2f}%")
-    print(f"   Recall@10: {test_results['recall@10']:.2f}%")
-    print(f"   MRR:       {test_results['mrr']:.4f}")
-    
-    # 3. Manual 셋 평가
-    print("\n" + "=" * 80)
-    print("3️⃣ Manual Set 평가 (30개 쿼리)")
-    print("=" * 80)
+    # 모델/Qdrant 연결은 세 데이터셋 평가에서 한 번만 생성
+    model = load_model()
+    client = QdrantClient(QDRANT_URL)
     
-    manual_results = evaluate_on_dataset(
-        DATA_DIR / "queries_manual.txt",
-        DATA_DIR / "ground_truth_manual.csv",
-        COLLECTION_NAME
-    )
+    datasets = {
+        'dev': ("1️⃣ Dev Set 평가 (70개 쿼리)", "queries_dev.txt", "ground_truth_dev.csv"),
+        'test': ("2️⃣ Test Set 평가 (31개 쿼리)", "queries_test.txt", "ground_truth_test.csv"),
+        'manual': ("3️⃣ Manual Set 평가 (30개 쿼리)", "queries_manual.txt", "ground_truth_manual.csv"),
+    }
     
-    print(f"\n📊 결과:")
-    print(f"   Recall@1:  {manual_results['recall@1']:.2f}%")
-    print(f"   Recall@3:  {manual_results['recall@3']:.2f}%")
-    print(f"   Recall@5:  {manual_results['recall@5']:.2f}%")
-    print(f"   Recall@10: {manual_results['recall@10']:.2f}%")
-    print(f"   MRR:       {manual_results['mrr']:.4f}")
+    # 로드/인코딩은 메인 스레드에서 데이터셋마다 차례로 (HF fast tokenizer는 스레드 간 동시 encode 불가)
+    # Qdrant search_batch 왕복만 스레드로 겹침
+    all_results = {}
+    with ThreadPoolExecutor(max_workers=len(datasets)) as executor:
+        futures = {}
+        for name, (heading, queries_name, gt_name) in datasets.items():
+            print("\n" + "=" * 80)
+            print(heading)
+            print("=" * 80)
+            
+            queries_with_gt, ground_truth = load_dataset(DATA_DIR / queries_name, DATA_DIR / gt_name)
+            query_vectors = encode_queries(model, queries_with_gt)
+            futures[name] = (
+                queries_with_gt,
+                ground_truth,
+                executor.submit(search_all, client, COLLECTION_NAME, query_vectors, top_k=10)
+            )
+        
+        # 데이터셋별 채점/진행 출력은 검색이 끝난 뒤 순서대로
+        for name, (queries_with_gt, ground_truth, future) in futures.items():
+            all_results[name] = score_dataset(queries_with_gt, ground_truth, future.result(), name=name)
+    
+    # 데이터셋별 결과 (순서대로 출력)
+    for name, (heading, _, _) in datasets.items():
+        results = all_results[name]
+        print("\n" + "=" * 80)
+        print(heading)
+        print("=" * 80)
+        
+        print(f"\n📊 결과:")
+        print(f"   Recall@1:  {results['recall@1']:.2f}%")
+        print(f"   Recall@3:  {results['recall@3']:.2f}%")
+        print(f"   Recall@5:  {results['recall@5']:.2f}%")
+        print(f"   Recall@10: {results['recall@10']:.2f}%")
+        print(f"   MRR:       {results['mrr']:.4f}")
+    
+    dev_results = all_results['dev']
+    test_results = all_results['test']
+    manual_results = all_results['manual']
     
     # 4. 전체 요약
     print("\n" + "=" * 80)
@@ -86,13 +86,13 @@ def improve_queries():
     
     if choice == '1':
         # 백업
+        # (복사 없이 rename만 하므로 원자적이고 중간에 깨진 파일이 남지 않음)
         backup_path = DATA_DIR / "queries_100_original.txt"
-        import shutil
-        shutil.copy(input_path, backup_path)
+        input_path.replace(backup_path)
         print(f"\n💾 원본 백업: {backup_path}")
         
-        # 덮어쓰기
-        shutil.copy(output_path, input_path)
+        # 덮어쓰기 (개선된 파일을 queries_100.txt 자리로 이동)
+        output_path.replace(input_path)
         print(f"✅ queries_100.txt 업데이트 완료!")
     else:
         print(f"\n✅ queries_100_improved.txt로 저장됨")
@@ -7,10 +7,14 @@
 """
 
 import csv
+import os
 import sys
+from functools import lru_cache
 from pathlib import Path
 from qdrant_client import QdrantClient
+from qdrant_client.http import models as qm
 from sentence_transformers import SentenceTransformer
+from query_cache import default_cache_path, get_or_encode
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -18,22 +22,45 @@ PROJECT_ROOT = Path(__file__).resolve().parents[1]
 DATA_DIR = PROJECT_ROOT / "data"
 
 COLLECTION_NAME = "kit_corpus_bge_all"
+EMBED_MODEL = 'BAAI/bge-m3'
 QDRANT_URL = "http://localhost:6333"
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "0") == "1"  # gRPC(6334) 전송 사용 여부
 
-def show_search_results(query, client, model, top_k=5):
-    """쿼리에 대한 검색 결과 보여주기"""
+# 검색 결과에서 실제로 읽는 payload 필드만 받음 (전체 payload 역직렬화 비용 절감)
+PAYLOAD_FIELDS = ['title', 'text', 'url', 'source_type']
+RESULT_FIELDS = ['query', 'document_name', 'rank', 'similarity']
+SEARCH_PARAMS = qm.SearchParams(hnsw_ef=64, exact=False)  # Top-5 검색에는 충분한 HNSW 탐색 폭
+
+@lru_cache(maxsize=1)
+def load_model():
+    """BGE-M3 모델 (처음 필요할 때 한 번만 로드)"""
+    print(f"🤖 BGE-M3 모델 로드 중...")
+    return SentenceTransformer(EMBED_MODEL)
+
+def search_all(client, query_vectors, top_k=5, chunk_size=64):
+    """여러 쿼리를 search_batch로 묶어서 검색 (쿼리마다 왕복하지 않도록)"""
+    results = []
+    for start in range(0, len(query_vectors), chunk_size):
+        requests = [
+            qm.SearchRequest(
+                vector=vec.tolist(),
+                limit=top_k,
+                with_payload=PAYLOAD_FIELDS,
+                with_vector=False,  # 표시에는 벡터가 필요 없음 (응답 크기 절감)
+                params=SEARCH_PARAMS
+            )
+            for vec in query_vectors[start:start + chunk_size]
+        ]
+        results.extend(client.search_batch(collection_name=COLLECTION_NAME, requests=requests))
+    
+    return results
+
+def show_search_results(query, results):
+    """쿼리에 대한 검색 결과 보여주기 (results: search_all로 미리 가져온 검색 결과)"""
     print("\n" + "=" * 80)
     print(f"🔍 쿼리: {query}")
     print("=" * 80)
     
-    # 검색
-    query_vector = model.encode(query, normalize_embeddings=True).tolist()
-    results = client.search(
-        collection_name=COLLECTION_NAME,
-        query_vector=query_vector,
-        limit=top_k
-    )
-    
     # 결과 출력
     for i, hit in enumerate(results, 1):
         score = hit.score
@@ -70,11 +97,13 @@ def manual_verification(queries_file, output_file):
     
     # 기존 검증 결과 로드 (중단 후 재시작 가능)
     verified = {}
+    resumed = False
     if output_file.exists():
         print(f"\n⚠️  기존 검증 파일 발견: {output_file}")
         response = input("기존 결과를 이어서 진행할까요? (y/n): ").strip().lower()
         
         if response == 'y':
+            resumed = True
             with output_file.open('r', encoding='utf-8') as f:
                 reader = csv.DictReader(f)
                 for row in reader:
@@ -85,12 +114,17 @@ def manual_verification(queries_file, output_file):
                     }
             print(f"✅ {len(verified)}개 이미 검증됨")
     
-    # Qdrant & 모델
-    print(f"\n🔌 Qdrant 연결 중...")
-    client = QdrantClient(QDRANT_URL)
-    
-    print(f"🤖 BGE-M3 모델 로드 중...")
-    model = SentenceTransformer('BAAI/bge-m3')
+    # 검증할 쿼리 임베딩/검색을 한 번에 처리 (입력 대기 중에 쿼리마다 인코딩·검색하지 않도록)
+    # 남은 쿼리가 없으면 Qdrant 연결/모델 로드 모두 생략, 모델은 임베딩 캐시 미스가 있을 때만 로드
+    pending = [q for q in queries if q not in verified]
+    search_cache = {}
+    if pending:
+        print(f"\n🔌 Qdrant 연결 중...")
+        client = QdrantClient(QDRANT_URL, prefer_grpc=QDRANT_PREFER_GRPC)
+        
+        # 이전 실행에서 인코딩한 쿼리는 디스크 캐시에서 재사용
+        query_vectors = get_or_encode(pending, load_model, default_cache_path(EMBED_MODEL))
+        search_cache = dict(zip(pending, search_all(client, query_vectors, top_k=5)))
     
     # 검증 시작
     print("\n" + "=" * 80)
@@ -104,6 +138,59 @@ def manual_verification(queries_file, output_file):
     
     results = []
     
+    # 검증 결과는 선택할 때마다 한 행씩 바로 기록 (이어하기면 기존 파일에 추가, 아니면 첫 기록 때 새로 작성)
+    out_file = None
+    writer = None
+    
+    def record(result):
+        nonlocal out_file, writer
+        results.append(result)
+        if writer is None:
+            out_file = output_file.open('a' if resumed else 'w', encoding='utf-8', newline='')
+            writer = csv.DictWriter(out_file, fieldnames=RESULT_FIELDS)
+            if out_file.tell() == 0:
+                writer.writeheader()
+        writer.writerow(result)
+        out_file.flush()
+        os.fsync(out_file.fileno())
+    
+    try:
+        stopped = verify_loop(queries, verified, search_cache, results, record)
+    finally:
+        if out_file is not None:
+            out_file.close()
+    
+    if stopped:
+        return len(results)
+    
+    print("\n" + "=" * 80)
+    print("🎉 검증 완료!")
+    print("=" * 80)
+    print(f"\n📊 통계:")
+    print(f"   총 쿼리: {len(queries)}개")
+    print(f"   검증됨: {len(results)}개")
+    print(f"   건너뜀: {len(queries) - len(results)}개")
+    
+    # 정답 분포
+    if results:
+        rank_dist = {}
+        for r in results:
+            rank = r['rank']
+            rank_dist[rank] = rank_dist.get(rank, 0) + 1
+        
+        print(f"\n📈 정답 순위 분포:")
+        for rank in sorted(rank_dist.keys()):
+            count = rank_dist[rank]
+            pct = count / len(results) * 100
+            if rank == -1:
+                print(f"   정답 없음: {count}개 ({pct:.1f}%)")
+            else:
+                print(f"   {rank}위: {count}개 ({pct:.1f}%)")
+    
+    return len(results)
+
+def verify_loop(queries, verified, search_cache, results, record):
+    """쿼리별 검증 입력 루프 (record: 새 검증 결과를 기록하는 함수) → 'q'로 중단하면 True"""
     for i, query in enumerate(queries, 1):
         # 이미 검증된 쿼리 건너뛰기
         if query in verified:
@@ -119,16 +206,15 @@ def manual_verification(queries_file, output_file):
         print(f"진행: {i}/{len(queries)} ({i/len(queries)*100:.1f}%)")
         
         # 검색 결과 보여주기
-        search_results = show_search_results(query, client, model, top_k=5)
+        search_results = show_search_results(query, search_cache[query])
         
         # 사용자 입력
         while True:
             user_input = input(f"\n정답 선택 (1-5, n=없음, s=건너뛰기, q=종료): ").strip().lower()
             
             if user_input == 'q':
-                print("\n💾 진행상황을 저장하고 종료합니다...")
-                save_results(results, output_file)
-                return len(results)
+                print("\n💾 진행상황이 저장되어 있습니다. 종료합니다...")
+                return True
             
             elif user_input == 's':
                 print("⏭️  건너뜀")
@@ -136,7 +222,7 @@ def manual_verification(queries_file, output_file):
             
             elif user_input == 'n':
                 print("❌ 정답 없음으로 기록")
-                results.append({
+                record({
                     'query': query,
                     'document_name': 'NO_ANSWER',
                     'rank': -1,
@@ -153,7 +239,7 @@ def manual_verification(queries_file, output_file):
                     
                     print(f"✅ {rank}번 선택: {title} (스코어: {score:.4f})")
                     
-                    results.append({
+                    record({
                         'query': query,
                         'document_name': title,
                         'rank': rank,
@@ -164,51 +250,8 @@ def manual_verification(queries_file, output_file):
                     print("❌ 1-5 사이의 숫자를 입력하세요")
             else:
                 print("❌ 잘못된 입력입니다")
-        
-        # 10개마다 자동 저장
-        if len(results) % 10 == 0:
-            save_results(results, output_file)
-            print(f"\n💾 자동 저장됨 ({len(results)}개)")
-    
-    # 최종 저장
-    save_results(results, output_file)
-    
-    print("\n" + "=" * 80)
-    print("🎉 검증 완료!")
-    print("=" * 80)
-    print(f"\n📊 통계:")
-    print(f"   총 쿼리: {len(queries)}개")
-    print(f"   검증됨: {len(results)}개")
-    print(f"   건너뜀: {len(queries) - len(results)}개")
-    
-    # 정답 분포
-    if results:
-        rank_dist = {}
-        for r in results:
-            rank = r['rank']
-            rank_dist[rank] = rank_dist.get(rank, 0) + 1
-        
-        print(f"\n📈 정답 순위 분포:")
-        for rank in sorted(rank_dist.keys()):
-            count = rank_dist[rank]
-            pct = count / len(results) * 100
-            if rank == -1:
-                print(f"   정답 없음: {count}개 ({pct:.1f}%)")
-            else:
-                print(f"   {rank}위: {count}개 ({pct:.1f}%)")
-    
-    return len(results)
-
-def save_results(results, output_file):
-    """결과 저장"""
-    if not results:
-        return
     
-    with output_file.open('w', encoding='utf-8', newline='') as f:
-        fieldnames = ['query', 'document_name', 'rank', 'similarity']
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(results)
+    return False
 
 def main():
     print("\n" + "=" * 80)
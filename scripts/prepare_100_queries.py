@@ -8,15 +8,22 @@
 - 중요도 순 정렬
 """
 
+import re
 from pathlib import Path
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 DATA_DIR = PROJECT_ROOT / "data"
 
+# 중복 판정용 정규화: 구두점 제거, 공백 정리, 소문자화 ("통학버스 시간?" == "통학버스  시간")
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_WS_RE = re.compile(r'\s+')
+
+def canonical_query(query):
+    """공백/구두점/대소문자만 다른 쿼리를 같은 키로 묶기 위한 정규화"""
+    return _WS_RE.sub(' ', _PUNCT_RE.sub('', query)).strip().lower()
+
 def load_queries():
     """모든 쿼리 로드"""
-    all_queries = []
-    
     # Dev 쿼리 (69개)
     dev_path = DATA_DIR / "queries_dev.txt"
     with dev_path.open('r', encoding='utf-8') as f:
@@ -37,12 +44,11 @@ def load_queries():
     print(f"   Test: {len(test_queries)}개")
     print(f"   Manual: {len(manual_queries)}개")
     
-    # 중복 제거하면서 합치기 (순서 유지)
-    seen = set()
+    # 중복 제거하면서 합치기 (정규화 키 기준, 처음 나온 원문 유지 / dict는 삽입 순서 유지)
+    unique = {}
     for query in manual_queries + dev_queries + test_queries:
-        if query not in seen:
-            all_queries.append(query)
-            seen.add(query)
+        unique.setdefault(canonical_query(query), query)
+    all_queries = list(unique.values())
     
     print(f"\n   중복 제거 후: {len(all_queries)}개")
     
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+쿼리 임베딩 디스크 캐시
+
+검증/평가 스크립트(manual_ground_truth_verification.py, quick_verify_sample.py, eval_hybrid.py,
+regenerate_ground_truth.py, test_hybrid_bge.py, test_reranking.py)를 다시 실행하거나 이어서 진행할 때
+같은 쿼리를 BGE-M3로 다시 인코딩하지 않도록
+sha1(쿼리) → 벡터를 .npz로 저장하고, 캐시에 없는 쿼리만 한 번에 인코딩.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+CACHE_DIR = PROJECT_ROOT / "data" / ".cache"
+
+def query_key(query):
+    """캐시 키 (쿼리 문자열의 sha1)"""
+    return hashlib.sha1(query.encode('utf-8')).hexdigest()
+
+def default_cache_path(model_name):
+    """모델별 캐시 파일 경로 (모델이 다르면 벡터도 다르므로 파일을 분리)"""
+    return CACHE_DIR / f"query_vectors_{model_name.replace('/', '__')}.npz"
+
+def load_cache(cache_path):
+    """캐시 로드 → {키: 벡터} (파일이 없으면 빈 dict)"""
+    if not cache_path.exists():
+        return {}
+    with np.load(cache_path) as data:
+        return dict(zip(data['keys'].tolist(), data['vectors']))
+
+def save_cache(cache, cache_path):
+    """캐시 저장 (임시 파일에 쓴 뒤 교체해 중단돼도 기존 캐시가 깨지지 않음)"""
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(cache_path.name + '.tmp.npz')
+    keys = list(cache)
+    np.savez(tmp_path, keys=np.array(keys), vectors=np.stack([cache[k] for k in keys]))
+    os.replace(tmp_path, cache_path)
+
+def get_or_encode(queries, load_model, cache_path, batch_size=64):
+    """쿼리 임베딩 (N x D, 정규화됨) - 캐시에 없는 쿼리만 한 번의 배치 인코딩
+    
+    load_model: 모델을 반환하는 인자 없는 함수 (캐시 미스가 있을 때만 호출 → 모두 캐시면 모델 로드 생략)
+    """
+    cache = load_cache(cache_path)
+    keys = [query_key(q) for q in queries]
+    
+    missing = list(dict.fromkeys(q for q, k in zip(queries, keys) if k not in cache))
+    if missing:
+        vectors = load_model().encode(
+            missing,
+            batch_size=batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=len(missing) > batch_size
+        )
+        cache.update(zip((query_key(q) for q in missing), vectors))
+        save_cache(cache, cache_path)
+    
+    if not keys:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.stack([cache[k] for k in keys])
@@ -4,16 +4,24 @@
 수동 검증이 어떻게 작동하는지 테스트
 """
 
+import os
 import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).parent))
 
 from qdrant_client import QdrantClient
+from qdrant_client.http import models as qm
 from sentence_transformers import SentenceTransformer
+from query_cache import default_cache_path, get_or_encode
 import warnings
 warnings.filterwarnings('ignore')
 
 COLLECTION_NAME = "kit_corpus_bge_all"
+EMBED_MODEL = 'BAAI/bge-m3'
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "0") == "1"  # gRPC(6334) 전송 사용 여부
+
+# 검색 결과에서 실제로 읽는 payload 필드만 받음
+PAYLOAD_FIELDS = ['title', 'text']
 
 def quick_verify():
     """5개 샘플 쿼리로 빠른 검증"""
@@ -33,10 +41,7 @@ def quick_verify():
     
     # 연결
     print("\n🔌 Qdrant 연결 중...")
-    client = QdrantClient("http://localhost:6333")
-    
-    print("🤖 BGE-M3 모델 로드 중...")
-    model = SentenceTransformer('BAAI/bge-m3')
+    client = QdrantClient("http://localhost:6333", prefer_grpc=QDRANT_PREFER_GRPC)
     
     print("\n" + "=" * 80)
     print("사용법:")
@@ -45,21 +50,34 @@ def quick_verify():
     print("  - 'n' = 정답 없음, 's' = 건너뛰기")
     print("=" * 80)
     
+    # 5개 쿼리를 한 번에 인코딩(이전 실행 결과는 디스크 캐시 재사용)하고 search_batch 한 번으로 검색
+    # (모델은 캐시 미스가 있을 때만 로드)
+    def load_model():
+        print("🤖 BGE-M3 모델 로드 중...")
+        return SentenceTransformer(EMBED_MODEL)
+    
+    query_vectors = get_or_encode(sample_queries, load_model, default_cache_path(EMBED_MODEL))
+    all_search_results = client.search_batch(
+        collection_name=COLLECTION_NAME,
+        requests=[
+            qm.SearchRequest(
+                vector=vec.tolist(),
+                limit=3,
+                with_payload=PAYLOAD_FIELDS,
+                with_vector=False,  # 표시에는 벡터가 필요 없음 (응답 크기 절감)
+                params=qm.SearchParams(hnsw_ef=64, exact=False)
+            )
+            for vec in query_vectors
+        ]
+    )
+    
     results = []
     
-    for i, query in enumerate(sample_queries, 1):
+    for i, (query, search_results) in enumerate(zip(sample_queries, all_search_results), 1):
         print(f"\n\n{'='*80}")
         print(f"[{i}/5] 쿼리: {query}")
         print("=" * 80)
         
-        # 검색
-        query_vector = model.encode(query, normalize_embeddings=True).tolist()
-        search_results = client.search(
-            collection_name=COLLECTION_NAME,
-            query_vector=query_vector,
-            limit=3
-        )
-        
         # 결과 출력
         for j, hit in enumerate(search_results, 1):
             score = hit.score
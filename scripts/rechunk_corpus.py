@@ -4,10 +4,28 @@
 """
 
 import csv
+import os
 import sys
 import re
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
 from pathlib import Path
-from typing import List
+from typing import Dict, List
+
+# 선택 의존성: pyarrow가 있으면 멀티스레드 C++ CSV 파서/라이터 사용 (없으면 csv 모듈)
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = None
+
+# 선택 의존성: numba가 있으면 청크 경계 탐색 루프를 JIT 컴파일 (없으면 순수 파이썬 루프)
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:
+    njit = None
 
 # CSV 필드 크기 제한 해제
 csv.field_size_limit(sys.maxsize)
@@ -17,6 +35,15 @@ CHUNK_SIZE = 1000
 OVERLAP = 150
 MIN_CHUNK_LENGTH = 100
 
+# 청킹 병렬 처리 (정제/청킹은 순수 함수라 행 단위로 프로세스에 분배)
+RECHUNK_WORKERS = int(os.getenv("RECHUNK_WORKERS", str(os.cpu_count() or 1)))
+# 한 번에 워커에 넘기는 행 수 (메모리에는 이 블록만 올라감)
+ROW_BLOCK_SIZE = 2048
+# pyarrow 읽기 블록 크기 (한 행이 블록보다 크면 안 되므로 긴 문서 기준으로 넉넉히)
+ARROW_BLOCK_SIZE = int(os.getenv("ARROW_BLOCK_SIZE", str(64 << 20)))
+# csv 모듈 경로의 파일 버퍼 크기 (기본 8KB 대신 1MB → write/read 시스템 콜 수 감소)
+IO_BUFFER_SIZE = 1 << 20
+
 # 필터링 패턴
 FILTER_PATTERNS = [
     r'^\s*차\s*례\s*$',
@@ -31,6 +58,15 @@ FILTER_PATTERNS = [
     r'^\s*-\s*\d+\s*-\s*$',
 ]
 
+# 필터링 패턴을 하나의 정규식으로 미리 컴파일 (줄마다 패턴 수만큼 re.match하지 않도록)
+_FILTER_RE = re.compile("|".join(f"(?:{p})" for p in FILTER_PATTERNS), re.IGNORECASE)
+_WS_RE = re.compile(r'\s+')
+_NL_RE = re.compile(r'\n\s*\n+')
+
+# 문장 경계 문자 / 경계로 인정하는 최소 위치 (청크 절반 이후)
+SENTENCE_TERMINATORS = ('.', '!', '?', '。', '\n')
+_MIN_BOUNDARY = int(CHUNK_SIZE * 0.5) + 1
+
 def clean_text(text: str) -> str:
     """텍스트 정제 및 불필요한 패턴 제거"""
     if not text:
@@ -40,26 +76,54 @@ def clean_text(text: str) -> str:
     cleaned_lines = []
     
     for line in lines:
-        should_skip = False
-        for pattern in FILTER_PATTERNS:
-            if re.match(pattern, line.strip(), re.IGNORECASE):
-                should_skip = True
-                break
-        
-        if not should_skip and line.strip():
+        stripped = line.strip()
+        if stripped and not _FILTER_RE.match(stripped):
             cleaned_lines.append(line)
     
     text = '\n'.join(cleaned_lines)
-    text = re.sub(r'\s+', ' ', text)
-    text = re.sub(r'\n\s*\n+', '\n', text)
+    text = _WS_RE.sub(' ', text)
+    text = _NL_RE.sub('\n', text)
     
     return text.strip()
 
+def _chunk_bounds_impl(codes, chunk_size, overlap, min_boundary):
+    """코드포인트 배열 → 청크 (start, end) 경계 목록 (chunk_text의 분할 규칙과 동일)"""
+    n = len(codes)
+    bounds = []
+    start = 0
+    
+    while start < n:
+        end = start + chunk_size
+        
+        if end < n:
+            # 뒤쪽 절반에서 마지막 문장 경계 ('.', '!', '?', '。', '\n')
+            for i in range(end - 1, start + min_boundary - 1, -1):
+                c = codes[i]
+                if c == 46 or c == 33 or c == 63 or c == 12290 or c == 10:
+                    end = i + 1
+                    break
+        
+        bounds.append((start, min(end, n)))
+        
+        start = end - overlap
+        if start <= 0 or start >= n:
+            break
+    
+    return bounds
+
+_chunk_bounds = njit(cache=True)(_chunk_bounds_impl) if njit is not None else None
+
 def chunk_text(text: str) -> List[str]:
     """텍스트를 청크로 분할"""
     if len(text) <= CHUNK_SIZE:
         return [text] if text.strip() and len(text) >= MIN_CHUNK_LENGTH else []
     
+    if _chunk_bounds is not None:
+        # UTF-32 코드포인트 배열로 넘겨 문자 단위 인덱스를 그대로 사용, 경계만 JIT 루프에서 계산
+        codes = np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+        chunks = (text[s:e].strip() for s, e in _chunk_bounds(codes, CHUNK_SIZE, OVERLAP, _MIN_BOUNDARY))
+        return [chunk for chunk in chunks if chunk and len(chunk) >= MIN_CHUNK_LENGTH]
+    
     chunks = []
     start = 0
     
@@ -68,13 +132,8 @@ def chunk_text(text: str) -> List[str]:
         chunk = text[start:end]
         
         if end < len(text):
-            last_period = max(
-                chunk.rfind('.'),
-                chunk.rfind('!'),
-                chunk.rfind('?'),
-                chunk.rfind('。'),
-                chunk.rfind('\n')
-            )
+            # 청크 뒤쪽 절반에서만 경계를 찾음 (앞쪽 절반의 경계는 어차피 버려짐)
+            last_period = max(chunk.rfind(t, _MIN_BOUNDARY) for t in SENTENCE_TERMINATORS)
             
             if last_period > CHUNK_SIZE * 0.5:
                 end = start + last_period + 1
@@ -90,6 +149,83 @@ def chunk_text(text: str) -> List[str]:
     
     return chunks
 
+def chunk_row(row: Dict[str, str]) -> List[Dict[str, str]]:
+    """원본 한 행 → 청크 레코드 리스트 (정제 후 너무 짧거나 청크가 없으면 빈 리스트)"""
+    # 텍스트 정제
+    cleaned_text = clean_text(row.get('text', ''))
+    
+    if not cleaned_text or len(cleaned_text) < MIN_CHUNK_LENGTH:
+        return []
+    
+    # 청킹
+    chunks = chunk_text(cleaned_text)
+    
+    # 각 청크를 개별 레코드로 저장
+    new_rows = []
+    for chunk_idx, chunk in enumerate(chunks):
+        new_row = row.copy()
+        new_row['text'] = chunk
+        new_row['chunk_index'] = chunk_idx
+        new_row['total_chunks'] = len(chunks)
+        
+        # document_name 업데이트
+        if 'document_name' in new_row:
+            original_name = new_row['document_name']
+            new_row['document_name'] = f"{original_name}_chunk{chunk_idx}"
+        
+        new_rows.append(new_row)
+    
+    return new_rows
+
+def read_fieldnames(input_file: Path) -> List[str]:
+    """CSV 헤더 (컬럼 이름) 읽기"""
+    with input_file.open('r', encoding='utf-8', newline='') as f:
+        return next(csv.reader(f), [])
+
+def iter_row_blocks(input_file: Path, fieldnames: List[str]):
+    """원본 CSV를 행(dict) 블록 단위로 스트리밍"""
+    if pa is not None:
+        # 모든 컬럼을 문자열로 읽어 csv.DictReader와 같은 값 유지 (빈 칸 → "")
+        reader = pacsv.open_csv(
+            input_file,
+            read_options=pacsv.ReadOptions(block_size=ARROW_BLOCK_SIZE),
+            parse_options=pacsv.ParseOptions(newlines_in_values=True),
+            convert_options=pacsv.ConvertOptions(
+                column_types={name: pa.string() for name in fieldnames},
+                strings_can_be_null=False
+            )
+        )
+        for batch in reader:
+            yield batch.to_pylist()
+        return
+    
+    with input_file.open('r', buffering=IO_BUFFER_SIZE, encoding='utf-8', newline='') as fin:
+        reader = csv.DictReader(fin)
+        while True:
+            block = list(islice(reader, ROW_BLOCK_SIZE))
+            if not block:
+                break
+            yield block
+
+@contextmanager
+def open_row_writer(output_file: Path, fieldnames: List[str]):
+    """청크 레코드 블록을 CSV로 기록하는 write_rows(rows) 함수를 제공"""
+    if pa is not None:
+        schema = pa.schema([(name, pa.string()) for name in fieldnames])
+        with pacsv.CSVWriter(str(output_file), schema) as writer:
+            def write_rows(rows):
+                writer.write_table(pa.Table.from_pydict({
+                    name: ['' if r.get(name) is None else str(r[name]) for r in rows]
+                    for name in fieldnames
+                }, schema=schema))
+            yield write_rows
+        return
+    
+    with output_file.open('w', buffering=IO_BUFFER_SIZE, encoding='utf-8', newline='') as fout:
+        writer = csv.DictWriter(fout, fieldnames=fieldnames)
+        writer.writeheader()
+        yield writer.writerows
+
 def process_corpus_file(input_file: Path, output_file: Path):
     """기존 corpus 파일에 청킹 + 필터링 적용"""
     print("=" * 80)
@@ -105,88 +241,78 @@ def process_corpus_file(input_file: Path, output_file: Path):
         print(f"\n❌ 파일 없음: {input_file}")
         return
     
-    # 원본 읽기
-    with input_file.open('r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        rows = list(reader)
-    
-    print(f"\n📊 원본 문서: {len(rows)}개")
-    
-    # 텍스트 길이 분석
-    text_lengths = [len(row.get('text', '')) for row in rows]
-    avg_length = sum(text_lengths) / len(text_lengths) if text_lengths else 0
-    max_length = max(text_lengths) if text_lengths else 0
-    
-    print(f"   평균 길이: {avg_length:,.0f}자")
-    print(f"   최대 길이: {max_length:,}자")
-    
-    # 청킹 적용
-    results = []
+    # 원본을 한 행씩 읽어 청킹 결과를 바로 기록 (전체 행/청크를 메모리에 올리지 않음)
+    num_rows = 0
+    text_length_sum = 0
+    max_length = 0
     total_chunks = 0
     skipped = 0
+    chunk_length_sum = 0
     
-    print(f"\n⏳ 청킹 중...")
+    print(f"\n⏳ 청킹 중... (워커 {RECHUNK_WORKERS}개)")
     
-    for i, row in enumerate(rows, 1):
-        if i % 200 == 0:
-            print(f"   진행: {i}/{len(rows)} ({i/len(rows)*100:.0f}%)")
-        
-        text = row.get('text', '')
-        
-        # 텍스트 정제
-        cleaned_text = clean_text(text)
-        
-        if not cleaned_text or len(cleaned_text) < MIN_CHUNK_LENGTH:
-            skipped += 1
-            continue
-        
-        # 청킹
-        chunks = chunk_text(cleaned_text)
-        
-        if not chunks:
-            skipped += 1
-            continue
-        
-        # 각 청크를 개별 레코드로 저장
-        for chunk_idx, chunk in enumerate(chunks):
-            new_row = row.copy()
-            new_row['text'] = chunk
-            new_row['chunk_index'] = chunk_idx
-            new_row['total_chunks'] = len(chunks)
+    executor = ProcessPoolExecutor(max_workers=RECHUNK_WORKERS) if RECHUNK_WORKERS > 1 else None
+    
+    input_fields = read_fieldnames(input_file)
+    fieldnames = input_fields + [name for name in ('chunk_index', 'total_chunks') if name not in input_fields]
+    
+    with open_row_writer(output_file, fieldnames) as write_rows:
+        # 블록 단위로 읽어 워커에 분배 (map은 입력 순서를 유지하므로 출력 순서는 그대로)
+        for block in iter_row_blocks(input_file, input_fields):
+            chunked = executor.map(chunk_row, block, chunksize=64) if executor else map(chunk_row, block)
             
-            # document_name 업데이트
-            if 'document_name' in new_row:
-                original_name = new_row['document_name']
-                new_row['document_name'] = f"{original_name}_chunk{chunk_idx}"
+            out_rows = []
+            for row, new_rows in zip(block, chunked):
+                num_rows += 1
+                if num_rows % 200 == 0:
+                    print(f"   진행: {num_rows}개 문서")
+                
+                # 텍스트 길이 분석 (누적 합계만 유지)
+                text_length = len(row.get('text', ''))
+                text_length_sum += text_length
+                max_length = max(max_length, text_length)
+                
+                if not new_rows:
+                    skipped += 1
+                    continue
+                
+                out_rows.extend(new_rows)
+                chunk_length_sum += sum(len(r['text']) for r in new_rows)
+                total_chunks += len(new_rows)
             
-            results.append(new_row)
-        
-        total_chunks += len(chunks)
+            # 블록 단위로 한 번에 기록
+            if out_rows:
+                write_rows(out_rows)
+    
+    if executor:
+        executor.shutdown()
+    
+    avg_length = text_length_sum / num_rows if num_rows else 0
+    
+    print(f"\n📊 원본 문서: {num_rows}개")
+    print(f"   평균 길이: {avg_length:,.0f}자")
+    print(f"   최대 길이: {max_length:,}자")
     
     print(f"\n✅ 처리 완료!")
-    print(f"   원본 문서: {len(rows)}개")
+    print(f"   원본 문서: {num_rows}개")
     print(f"   제외: {skipped}개")
     print(f"   청크 생성: {total_chunks}개")
-    print(f"   최종 레코드: {len(results)}개")
+    print(f"   최종 레코드: {total_chunks}개")
     
     # 저장
-    if results:
-        with output_file.open('w', encoding='utf-8', newline='') as f:
-            fieldnames = results[0].keys()
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(results)
-        
+    if total_chunks:
         print(f"\n💾 저장: {output_file}")
         
         # 통계
-        chunk_lengths = [len(r['text']) for r in results]
-        avg_chunk = sum(chunk_lengths) / len(chunk_lengths)
+        avg_chunk = chunk_length_sum / total_chunks
         
         print(f"\n📊 최종 통계:")
-        print(f"   총 청크: {len(results):,}개")
+        print(f"   총 청크: {total_chunks:,}개")
         print(f"   평균 길이: {avg_chunk:.0f}자")
-        print(f"   총 텍스트: {sum(chunk_lengths):,}자")
+        print(f"   총 텍스트: {chunk_length_sum:,}자")
+    else:
+        # 기존 동작과 같이 청크가 없으면 출력 파일을 남기지 않음
+        output_file.unlink()
     
     print("\n" + "=" * 80)
 
@@ -1,21 +1,35 @@
-import numpy as np
+import os
 import pandas as pd
 from pathlib import Path
 import sys
 sys.path.append(str(Path(__file__).parent))
-from embed_providers import get_encoder, DEFAULTS
+from embed_providers import encode_batches_to_memmap, DEFAULTS
+
+# 저장 dtype: 정규화된 임베딩은 float16으로도 코사인 유사도가 거의 변하지 않고
+# 디스크/메모리 사용량이 절반으로 줄어듦 (float32가 필요하면 EMBED_DTYPE=float32)
+EMBED_DTYPE = os.getenv("EMBED_DTYPE", "float16")
+# corpus CSV를 한 번에 읽는 행 수 (전체 corpus를 메모리에 올리지 않음)
+CSV_CHUNKSIZE = int(os.getenv("CSV_CHUNKSIZE", "8192"))
+
+def iter_text_chunks(corpus_path):
+    """corpus의 text 컬럼만 청크 단위로 읽어 유효한 텍스트 리스트를 순서대로 반환"""
+    for chunk in pd.read_csv(corpus_path, usecols=['text'], chunksize=CSV_CHUNKSIZE):
+        # NaN 제거 및 문자열 변환
+        texts = chunk['text'].dropna().astype(str).tolist()
+        yield [t for t in texts if t and t.strip()]
 
 def main():
-    # corpus_all.csv 로드
+    # corpus_all.csv (text 컬럼만, 청크 단위 스트리밍)
     corpus_path = Path(__file__).parent.parent / 'data' / 'corpus_all.csv'
-    df = pd.read_csv(corpus_path)
     
-    # NaN 제거 및 문자열 변환
-    df = df[df['text'].notna()]
-    texts = df['text'].astype(str).tolist()
-    texts = [t for t in texts if t and t.strip()]
+    # memmap shape를 정하기 위해 유효 텍스트 수만 먼저 셈
+    total = sum(len(texts) for texts in iter_text_chunks(corpus_path))
     
-    print(f"총 {len(texts):,}개의 텍스트 임베딩 생성 중...")
+    if total == 0:
+        print(f"❌ 임베딩할 텍스트가 없습니다: {corpus_path}")
+        return
+    
+    print(f"총 {total:,}개의 텍스트 임베딩 생성 중...")
     print(f"입력 파일: {corpus_path}")
     
     # 각 모델별로 임베딩 생성
@@ -24,22 +38,16 @@ def main():
     
     for model in models:
         print(f"\n📦 {model} 모델 임베딩 생성 중...")
-        encoder = get_encoder(model)
         embedder_name = DEFAULTS[model]
         
-        # 임베딩 생성
-        embeds, dim = encoder(texts, embedder_name)
-        
-        # 리스트인 경우 numpy 배열로 변환
-        if isinstance(embeds, list):
-            embeds = np.array(embeds)
-        
-        print(f"임베딩 shape: {embeds.shape}, dimension: {dim}")
-        
-        # 임베딩 저장
+        # 임베딩 생성 + 저장 (배치 단위로 .npy memmap에 바로 기록해 RAM 사용량 제한)
         output_path = Path(__file__).parent.parent / "embeddings" / f"{model}_all.npy"
         output_path.parent.mkdir(exist_ok=True)
-        np.save(output_path, embeds)
+        embeds = encode_batches_to_memmap(
+            iter_text_chunks(corpus_path), total, output_path, model, embedder_name, dtype=EMBED_DTYPE
+        )
+        
+        print(f"임베딩 shape: {embeds.shape}, dimension: {embeds.shape[1]}, dtype: {embeds.dtype}")
         print(f"✅ 저장 완료: {output_path}")
 
 if __name__ == "__main__":
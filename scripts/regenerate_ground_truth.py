@@ -5,8 +5,9 @@
 
 import csv
 from pathlib import Path
-from qdrant_client import QdrantClient
-from sentence_transformers import SentenceTransformer
+from qdrant_client.http import models as qm
+from eval_context import get_embed_model, get_qdrant_client
+from query_cache import default_cache_path, get_or_encode
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -14,7 +15,25 @@ PROJECT_ROOT = Path(__file__).resolve().parents[1]
 DATA_DIR = PROJECT_ROOT / "data"
 
 COLLECTION_NAME = "kit_corpus_bge_all"
-QDRANT_URL = "http://localhost:6333"
+EMBED_MODEL = 'BAAI/bge-m3'
+SEARCH_BATCH_SIZE = 16  # search_batch 한 번에 보내는 쿼리 수
+
+def load_model():
+    """BGE-M3 모델 (캐시에 없는 쿼리가 있을 때만 호출, 프로세스당 한 번만 로드)"""
+    print(f"\n🤖 BGE-M3 모델 준비 중...")
+    return get_embed_model(EMBED_MODEL)
+
+def search_top1_batch(client, query_vectors, chunk_size=SEARCH_BATCH_SIZE):
+    """쿼리 벡터들의 Top-1 검색을 search_batch로 묶어서 요청 (쿼리마다 왕복하지 않도록)"""
+    results = []
+    for start in range(0, len(query_vectors), chunk_size):
+        requests = [
+            qm.SearchRequest(vector=vec.tolist(), limit=1, with_payload=True)
+            for vec in query_vectors[start:start + chunk_size]
+        ]
+        results.extend(client.search_batch(collection_name=COLLECTION_NAME, requests=requests))
+    
+    return results
 
 def generate_ground_truth(queries_file, output_file):
     """쿼리에 대한 Ground Truth 생성"""
@@ -27,31 +46,23 @@ def generate_ground_truth(queries_file, output_file):
     print(f"   쿼리 수: {len(queries)}개")
     
     # Qdrant 연결
-    client = QdrantClient(QDRANT_URL)
-    
-    # BGE-M3 모델
-    print(f"\n🤖 BGE-M3 모델 로드 중...")
-    model = SentenceTransformer('BAAI/bge-m3')
+    client = get_qdrant_client()
     
     # Ground Truth 생성
     print(f"\n⏳ Ground Truth 생성 중...")
     
     results = []
     
-    for i, query in enumerate(queries, 1):
+    # 쿼리 임베딩 일괄 생성 (디스크 캐시에 없는 쿼리만 인코딩 → 재실행 시 인코딩 생략)
+    query_vectors = get_or_encode(queries, load_model, default_cache_path(EMBED_MODEL))
+    
+    # 검색 (Top-1, 일괄 요청)
+    all_search_results = search_top1_batch(client, query_vectors)
+    
+    for i, (query, search_results) in enumerate(zip(queries, all_search_results), 1):
         if i % 20 == 0:
             print(f"   진행: {i}/{len(queries)}")
         
-        # 쿼리 임베딩
-        query_vector = model.encode(query, normalize_embeddings=True).tolist()
-        
-        # 검색 (Top-1)
-        search_results = client.search(
-            collection_name=COLLECTION_NAME,
-            query_vector=query_vector,
-            limit=1
-        )
-        
         if search_results:
             top_hit = search_results[0]
             
@@ -7,81 +7,156 @@
 3단계: RRF (Reciprocal Rank Fusion)로 결과 결합
 """
 
+import sys
 import pandas as pd
 import numpy as np
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
-from qdrant_client import QdrantClient
+from query_cache import default_cache_path, get_or_encode
+from eval_context import get_embed_model, get_qdrant_client
+from qdrant_client.http import models as qm
 from rank_bm25 import BM25Okapi
+import scipy.sparse as sp
+from eval_hybrid import build_bm25_csr, query_term_matrix, read_corpus_csv, top_k_ranked
+import heapq
+from collections import Counter
+import os
+import re
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    import bm25s
+except ImportError:  # bm25s가 없으면 rank_bm25 기본 구현 사용
+    bm25s = None
+
+# bm25s 인덱스 사용 여부 (기본 꺼짐: 설치 여부에 따라 BM25/하이브리드 지표가 바뀌지 않도록)
+# robertson IDF, k1/b를 BM25Okapi와 맞추지만 df > N/2인 토큰의 IDF를 0으로 자르므로
+# (BM25Okapi는 평균 IDF의 epsilon배로 대체) 점수가 완전히 같지는 않음
+USE_BM25S = bm25s is not None and os.getenv("BM25_USE_BM25S", "0") == "1"
 import warnings
 warnings.filterwarnings('ignore')
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from core.bm25_numba import bm25_topk
+
 DATA_DIR = PROJECT_ROOT / "data"
 
 COLLECTION_NAME = "kit_corpus_bge_all"
-QDRANT_URL = "http://localhost:6333"
+EMBED_MODEL = 'BAAI/bge-m3'
+TOKENIZE_WORKERS = int(os.getenv("TOKENIZE_WORKERS", str(os.cpu_count() or 1)))
+
+# BM25 어휘 가지치기 (기본 꺼짐: 켜면 점수가 달라져 이전 결과와 직접 비교 불가)
+# 문서 빈도가 BM25_MIN_DF 미만이거나 전체 문서의 BM25_MAX_DF_RATIO 초과인 토큰, 1글자 토큰 제외
+BM25_PRUNE_VOCAB = os.getenv("BM25_PRUNE_VOCAB", "0") == "1"
+BM25_MIN_DF = int(os.getenv("BM25_MIN_DF", "2"))
+BM25_MAX_DF_RATIO = float(os.getenv("BM25_MAX_DF_RATIO", "0.5"))
+
+# 간단한 토큰화 (공백 기준, 미리 컴파일한 정규식 → 워커 프로세스로 넘길 수 있는 함수)
+_TOKEN_RE = re.compile(r'\S+')
+tokenize = _TOKEN_RE.findall
+
+def prune_vocab(tokenized_corpus):
+    """문서 빈도 기준으로 어휘를 줄인 토큰 목록
+    
+    쿼리 토큰은 따로 거를 필요 없음 (인덱스 어휘에 없는 토큰은 쿼리 term 행렬에서 빠짐)
+    """
+    df = Counter(token for tokens in tokenized_corpus for token in set(tokens))
+    max_df = BM25_MAX_DF_RATIO * len(tokenized_corpus)
+    keep = {token for token, count in df.items() if BM25_MIN_DF <= count <= max_df and len(token) >= 2}
+    print(f"   어휘 가지치기: {len(df):,} → {len(keep):,}개")
+    return [[token for token in tokens if token in keep] for tokens in tokenized_corpus]
 
 def prepare_bm25_index(corpus_df):
     """BM25 인덱스 준비"""
     print("\n📚 BM25 인덱스 준비 중...")
     
-    # 텍스트 토큰화 (한글 포함, 공백 분리)
-    tokenized_corpus = []
-    for text in corpus_df['text'].fillna('').astype(str):
-        # 간단한 토큰화 (공백 기준)
-        tokens = text.split()
-        tokenized_corpus.append(tokens)
+    # 텍스트 토큰화 (한글 포함, 공백 분리, CPU 코어 수만큼 병렬)
+    texts = corpus_df['text'].fillna('').astype(str).tolist()
+    if TOKENIZE_WORKERS > 1:
+        with ProcessPoolExecutor(max_workers=TOKENIZE_WORKERS) as executor:
+            tokenized_corpus = list(executor.map(tokenize, texts, chunksize=512))
+    else:
+        tokenized_corpus = [tokenize(text) for text in texts]
+    
+    if BM25_PRUNE_VOCAB:
+        tokenized_corpus = prune_vocab(tokenized_corpus)
     
-    # BM25 인덱스 생성
+    # BM25 인덱스 생성 (bm25s: 희소 행렬로 점수를 미리 계산 → 쿼리마다 Python 루프 없음)
     start = time.time()
-    bm25 = BM25Okapi(tokenized_corpus)
+    if USE_BM25S:
+        bm25 = bm25s.BM25(method="robertson", k1=1.5, b=0.75)
+        bm25.index(tokenized_corpus, show_progress=False)
+    else:
+        bm25 = BM25Okapi(tokenized_corpus)
     elapsed = time.time() - start
     
-    print(f"   ✅ {len(tokenized_corpus):,}개 문서 인덱싱 완료 ({elapsed:.1f}초)")
+    engine = "bm25s (robertson, 점수가 BM25Okapi와 조금 다름)" if USE_BM25S else "rank_bm25 BM25Okapi"
+    print(f"   ✅ {len(tokenized_corpus):,}개 문서 인덱싱 완료 ({elapsed:.1f}초, {engine})")
     
     return bm25
 
-def vector_search(query, model, client, top_k=20):
-    """BGE-M3 벡터 검색"""
-    query_vector = model.encode(query, normalize_embeddings=True).tolist()
-    
-    results = client.search(
-        collection_name=COLLECTION_NAME,
-        query_vector=query_vector,
-        limit=top_k
-    )
+def vector_search(query_vectors, client, top_k=20, chunk_size=16):
+    """BGE-M3 벡터 검색 (미리 일괄 인코딩한 쿼리 벡터들을 search_batch로 묶어서 요청)"""
+    results = []
+    for start in range(0, len(query_vectors), chunk_size):
+        requests = [
+            qm.SearchRequest(vector=vec.tolist(), limit=top_k, with_payload=True)
+            for vec in query_vectors[start:start + chunk_size]
+        ]
+        results.extend(client.search_batch(collection_name=COLLECTION_NAME, requests=requests))
     
     return results
 
-def bm25_search(query, bm25, corpus_df, top_k=20):
-    """BM25 키워드 검색"""
-    tokenized_query = query.split()
-    scores = bm25.get_scores(tokenized_query)
+def bm25_weight_matrix(bm25):
+    """BM25 term 가중치 (어휘 x 문서) CSR 행렬과 어휘 사전
     
-    # Top-K 인덱스
-    top_indices = np.argsort(scores)[::-1][:top_k]
+    bm25s는 (문서 x 어휘) CSC로 점수를 저장하므로 같은 배열을 전치된 CSR로 그대로 사용
+    """
+    if USE_BM25S:
+        scores = bm25.scores
+        matrix = sp.csr_matrix(
+            (scores['data'], scores['indices'], scores['indptr']),
+            shape=(len(scores['indptr']) - 1, scores['num_docs'])
+        )
+        return matrix, bm25.vocab_dict
+    return build_bm25_csr(bm25)
+
+def bm25_search(queries, bm25, top_k=20):
+    """BM25 키워드 검색 (전체 쿼리를 (쿼리 x 어휘) @ (어휘 x 문서) 희소 행렬곱 한 번으로 점수 계산)
     
-    results = []
-    for idx in top_indices:
-        results.append({
-            'index': idx,
-            'score': scores[idx],
-            'text': corpus_df.iloc[idx]['text'],
-            'document_name': corpus_df.iloc[idx].get('document_name', ''),
-            'title': corpus_df.iloc[idx].get('title', '')
-        })
+    numba가 있으면 쿼리 단위 병렬 커널(core.bm25_numba.bm25_topk)로 점수 행렬 없이 Top-K만 계산
+    반환: (쿼리 x K) 인덱스 행렬, (쿼리 x K) 점수 행렬 (점수 내림차순)
+    """
+    matrix, vocab = bm25_weight_matrix(bm25)
+    if matrix.shape[1] == 0:
+        return np.empty((len(queries), 0), dtype=np.int64), np.empty((len(queries), 0), dtype=np.float32)
+    
+    query_matrix = query_term_matrix(queries, vocab)
+    if bm25_topk is not None:
+        k = min(top_k, matrix.shape[1])
+        top_indices, top_scores = bm25_topk(
+            query_matrix.indptr, query_matrix.indices, query_matrix.data,
+            matrix.indptr, matrix.indices, matrix.data, matrix.shape[1],
+            np.empty((len(queries), k), dtype=np.int64),
+            np.empty((len(queries), k), dtype=np.float32)
+        )
+    else:
+        scores = (query_matrix @ matrix).toarray()
+        top_indices = top_k_ranked(scores, top_k)
+        top_scores = np.take_along_axis(scores, top_indices, axis=1)
     
-    return results
+    return top_indices, top_scores
 
-def reciprocal_rank_fusion(vector_results, bm25_results, corpus_df, 
-                           doc_name_to_idx, k=60, top_n=5):
+def reciprocal_rank_fusion(vector_results, bm25_indices, doc_name_to_idx, k=60, top_n=5):
     """
     RRF (Reciprocal Rank Fusion)로 결과 결합
     
     RRF 점수 = 1 / (k + rank)
     k: 일반적으로 60 사용
+    bm25_indices: BM25 Top-K 인덱스 (순위순)
+    반환: (인덱스 리스트, RRF 점수 리스트) - RRF 점수 내림차순 Top-N
     """
     rrf_scores = {}
     
@@ -98,25 +173,19 @@ def reciprocal_rank_fusion(vector_results, bm25_results, corpus_df,
                 rrf_scores[idx] = rrf_scores.get(idx, 0) + 1.0 / (k + rank)
     
     # 2. BM25 검색 결과 점수
-    for rank, result in enumerate(bm25_results, 1):
-        idx = result['index']
+    for rank, idx in enumerate(bm25_indices, 1):
         rrf_scores[idx] = rrf_scores.get(idx, 0) + 1.0 / (k + rank)
     
-    # 3. RRF 점수로 정렬
-    sorted_indices = sorted(rrf_scores.items(), key=lambda x: x[1], reverse=True)
-    
-    # 4. Top-N 추출
-    top_results = []
-    for idx, score in sorted_indices[:top_n]:
-        top_results.append({
-            'index': idx,
-            'rrf_score': score,
-            'text': corpus_df.iloc[idx]['text'],
-            'document_name': corpus_df.iloc[idx].get('document_name', ''),
-            'title': corpus_df.iloc[idx].get('title', '')
-        })
-    
-    return top_results
+    # 3. RRF 점수 Top-N 추출 (전체 정렬 없이 상위 N개만, 동점 순서는 sorted와 동일)
+    top = heapq.nlargest(top_n, rrf_scores.items(), key=lambda x: x[1])
+    return [idx for idx, _ in top], [score for _, score in top]
+
+def rank_metrics(top_indices, gt_indices):
+    """Top-5 기준 (Recall@1, Recall@5, MRR) - 첫 정답 순위는 적중 배열의 argmax"""
+    top5 = top_indices[:5]
+    hits = np.fromiter((idx in gt_indices for idx in top5), dtype=bool, count=len(top5))
+    rank = int(hits.argmax()) + 1 if hits.any() else 0
+    return float(hits[:1].any()), float(hits.any()), (1.0 / rank if rank else 0.0)
 
 def load_ground_truth():
     """Ground Truth 로드"""
@@ -137,34 +206,23 @@ def evaluate_hybrid():
     
     # 1. 모델 및 데이터 로드
     print("\n📦 준비 중...")
-    print("   BGE-M3 모델 로드...", end='', flush=True)
-    model = SentenceTransformer('BAAI/bge-m3')
-    print(" ✅")
-    
     print("   Qdrant 연결...", end='', flush=True)
-    client = QdrantClient(url=QDRANT_URL)
+    client = get_qdrant_client()
     print(" ✅")
     
     print("   Corpus 로드...", end='', flush=True)
-    corpus = pd.read_csv(DATA_DIR / "corpus_all.csv")
+    corpus = read_corpus_csv(DATA_DIR / "corpus_all.csv")
     print(f" ✅ ({len(corpus):,}개)")
     
-    # document_name → index 매핑
-    doc_name_to_idx = {}
-    for idx, row in corpus.iterrows():
-        # document_name이 있으면 사용 (첨부파일)
-        if pd.notna(row.get('document_name')) and row['document_name']:
-            doc_name = row['document_name']
-            # 여러 인덱스를 리스트로 저장 (중복 처리)
-            if doc_name not in doc_name_to_idx:
-                doc_name_to_idx[doc_name] = []
-            doc_name_to_idx[doc_name].append(idx)
-        # document_name이 없으면 title 사용 (크롤링 데이터)
-        elif pd.notna(row.get('title')) and row['title']:
-            title = row['title']
-            if title not in doc_name_to_idx:
-                doc_name_to_idx[title] = []
-            doc_name_to_idx[title].append(idx)
+    # document_name → index 매핑 (여러 인덱스를 리스트로 저장, 중복 처리)
+    # document_name이 있으면 사용 (첨부파일), 없으면 title 사용 (크롤링 데이터)
+    has_doc_name = corpus['document_name'].notna() & (corpus['document_name'] != '')
+    doc_key = corpus['document_name'].where(has_doc_name, corpus['title'])
+    doc_name_to_idx = {
+        key: idx.tolist()
+        for key, idx in corpus.groupby(doc_key.values).indices.items()
+        if pd.notna(key) and key
+    }
     
     # BM25 인덱스 준비
     bm25 = prepare_bm25_index(corpus)
@@ -183,31 +241,50 @@ def evaluate_hybrid():
     
     evaluated = 0
     
-    for _, row in gt_df.iterrows():
-        query = row['query']
-        gt_doc_name = row['document_name']
-        
-        if not isinstance(query, str) or not isinstance(gt_doc_name, str):
-            continue
-        
-        # GT 인덱스 찾기
+    gt_df = gt_df[gt_df['query'].apply(lambda q: isinstance(q, str))
+                  & gt_df['document_name'].apply(lambda d: isinstance(d, str))]
+    
+    # GT 매칭용 base_doc_name → 인덱스, title → 인덱스 (쿼리마다 corpus 전체를 다시 계산하지 않도록 한 번만)
+    base_doc_name = (
+        corpus['document_name'].fillna('').astype(str)
+        .str.rsplit('_chunk', n=1).str[0]
+        .str.replace(r'\.(pdf|xlsx|docx)', '', regex=True)
+        .str.strip()
+    )
+    base_to_indices = corpus.groupby(base_doc_name.values).indices
+    title_to_indices = corpus.groupby(corpus['title'].values).indices
+    
+    # GT 문서명 → GT 인덱스 (고유 문서명마다 한 번만 계산)
+    # 1. base_doc_name으로 매칭 (첨부파일), 2. 없으면 title로 매칭 (크롤링 데이터)
+    gt_to_indices = {}
+    for gt_doc_name in gt_df['document_name'].unique():
         gt_base = gt_doc_name.replace('.pdf', '').replace('.xlsx', '').replace('.docx', '').strip()
-        
-        # 1. base_doc_name으로 매칭 (첨부파일)
-        corpus['base_doc_name'] = corpus['document_name'].fillna('').apply(
-            lambda x: x.rsplit('_chunk', 1)[0].replace('.pdf', '').replace('.xlsx', '').replace('.docx', '').strip() if x else ''
+        gt_to_indices[gt_doc_name] = (
+            frozenset(base_to_indices.get(gt_base, ())) or frozenset(title_to_indices.get(gt_doc_name, ()))
         )
-        gt_indices = set(corpus[corpus['base_doc_name'] == gt_base].index.tolist())
-        
-        # 2. title로 매칭 (크롤링 데이터)
-        if not gt_indices:
-            gt_indices = set(corpus[corpus['title'] == gt_doc_name].index.tolist())
-        
-        if not gt_indices:
-            continue
+    
+    # GT 인덱스가 없는 쿼리는 평가에서 제외 (인코딩/검색 전에 미리 걸러냄)
+    gt_df = gt_df[gt_df['document_name'].map(gt_to_indices).astype(bool)]
+    
+    # 쿼리 임베딩 일괄 생성 (디스크 캐시에 없는 쿼리만 인코딩 → 재실행 시 모델 로드도 생략)
+    def load_model():
+        print("   BGE-M3 모델 준비...")
+        return get_embed_model(EMBED_MODEL)
+    
+    query_vectors = get_or_encode(gt_df['query'].tolist(), load_model, default_cache_path(EMBED_MODEL))
+    
+    # 벡터 검색 (Top-20, 일괄 요청)은 백그라운드 스레드에서 보내고
+    # 그동안 BM25 검색 (Top-20, 희소 행렬곱 한 번)을 로컬에서 계산 → 네트워크 대기와 겹침
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        vector_future = executor.submit(vector_search, query_vectors, client, 20)
+        all_bm25_indices, _ = bm25_search(gt_df['query'].tolist(), bm25, top_k=20)
+        all_vector_results = vector_future.result()
+    
+    for q_idx, (_, row) in enumerate(gt_df.iterrows()):
+        gt_indices = gt_to_indices[row['document_name']]
         
         # 1. Baseline: BGE-M3만
-        vector_results = vector_search(query, model, client, top_k=20)
+        vector_results = all_vector_results[q_idx]
         baseline_indices = []
         for hit in vector_results[:5]:
             doc_name = hit.payload.get('document_name', '')
@@ -217,58 +294,24 @@ def evaluate_hybrid():
                 # 리스트의 첫 번째 인덱스 사용
                 baseline_indices.append(doc_name_to_idx[doc_name][0])
         
-        # Baseline Recall
-        found_r1 = any(idx in gt_indices for idx in baseline_indices[:1])
-        found_r5 = any(idx in gt_indices for idx in baseline_indices[:5])
-        results_baseline['recall@1'].append(1.0 if found_r1 else 0.0)
-        results_baseline['recall@5'].append(1.0 if found_r5 else 0.0)
-        
-        # Baseline MRR
-        rank = 0
-        for i, idx in enumerate(baseline_indices[:5], 1):
-            if idx in gt_indices:
-                rank = i
-                break
-        results_baseline['mrr'].append(1.0 / rank if rank > 0 else 0.0)
-        
         # 2. BM25만
-        bm25_results = bm25_search(query, bm25, corpus, top_k=20)
-        bm25_indices = [r['index'] for r in bm25_results[:5]]
-        
-        # BM25 Recall
-        found_r1 = any(idx in gt_indices for idx in bm25_indices[:1])
-        found_r5 = any(idx in gt_indices for idx in bm25_indices[:5])
-        results_bm25['recall@1'].append(1.0 if found_r1 else 0.0)
-        results_bm25['recall@5'].append(1.0 if found_r5 else 0.0)
-        
-        # BM25 MRR
-        rank = 0
-        for i, idx in enumerate(bm25_indices[:5], 1):
-            if idx in gt_indices:
-                rank = i
-                break
-        results_bm25['mrr'].append(1.0 / rank if rank > 0 else 0.0)
+        bm25_ranked = all_bm25_indices[q_idx]
+        bm25_indices = bm25_ranked[:5]
         
         # 3. Hybrid: RRF
-        hybrid_results = reciprocal_rank_fusion(
-            vector_results, bm25_results, corpus, doc_name_to_idx, 
+        hybrid_indices, _ = reciprocal_rank_fusion(
+            vector_results, bm25_ranked, doc_name_to_idx, 
             k=60, top_n=5
         )
-        hybrid_indices = [r['index'] for r in hybrid_results]
-        
-        # Hybrid Recall
-        found_r1 = any(idx in gt_indices for idx in hybrid_indices[:1])
-        found_r5 = any(idx in gt_indices for idx in hybrid_indices[:5])
-        results_hybrid['recall@1'].append(1.0 if found_r1 else 0.0)
-        results_hybrid['recall@5'].append(1.0 if found_r5 else 0.0)
         
-        # Hybrid MRR
-        rank = 0
-        for i, idx in enumerate(hybrid_indices[:5], 1):
-            if idx in gt_indices:
-                rank = i
-                break
-        results_hybrid['mrr'].append(1.0 / rank if rank > 0 else 0.0)
+        # Recall@1, Recall@5, MRR (세 방식 모두 같은 계산)
+        for results, top_indices in ((results_baseline, baseline_indices),
+                                     (results_bm25, bm25_indices),
+                                     (results_hybrid, hybrid_indices)):
+            recall_1, recall_5, mrr = rank_metrics(top_indices, gt_indices)
+            results['recall@1'].append(recall_1)
+            results['recall@5'].append(recall_5)
+            results['mrr'].append(mrr)
         
         evaluated += 1
         
@@ -6,11 +6,16 @@
 2단계: Cross-Encoder로 재정렬 (정확)
 """
 
+import os
 import pandas as pd
 import numpy as np
+import torch
 from pathlib import Path
-from sentence_transformers import SentenceTransformer, CrossEncoder
+from sentence_transformers import CrossEncoder
 from qdrant_client import QdrantClient
+from qdrant_client.http import models as qm
+from query_cache import default_cache_path, get_or_encode
+from eval_context import get_embed_model
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -18,8 +23,17 @@ PROJECT_ROOT = Path(__file__).resolve().parents[1]
 DATA_DIR = PROJECT_ROOT / "data"
 
 COLLECTION_NAME = "kit_corpus_bge_all"
+EMBED_MODEL = "BAAI/bge-m3"
 QDRANT_URL = "http://localhost:6333"
 
+# CPU 추론 스레드 수 (기본: 전체 코어)
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", str(os.cpu_count() or 1)))
+torch.set_num_threads(TORCH_THREADS)
+
+# CPU에서 Cross-Encoder 점수 계산을 나눠 맡을 워커 프로세스 수 (1이면 현재 프로세스에서 계산)
+# 워커마다 리랭커를 새로 로드하므로 쌍이 많을 때만 이득 → 기본 1
+RERANK_PROCESSES = int(os.getenv("RERANK_PROCESSES", "1"))
+
 # 리랭킹 모델 옵션
 RERANKER_MODELS = {
     # BGE 리랭커 (BGE-M3와 같은 제작사, 다국어 지원)
@@ -46,31 +60,61 @@ def load_ground_truth():
     print(f"📋 Ground Truth: {len(gt_valid)}개")
     return gt_valid
 
-def initial_search(client, model, query, top_k=20):
-    """1단계: Bi-Encoder로 초기 검색"""
-    query_vector = model.encode(query, normalize_embeddings=True).tolist()
-    
-    results = client.search(
-        collection_name=COLLECTION_NAME,
-        query_vector=query_vector,
-        limit=top_k
-    )
+def initial_search(client, query_vectors, top_k=20, chunk_size=64):
+    """1단계: Bi-Encoder로 초기 검색 (search_batch로 여러 쿼리를 한 번에 요청)"""
+    results = []
+    for start in range(0, len(query_vectors), chunk_size):
+        requests = [
+            qm.SearchRequest(vector=vec.tolist(), limit=top_k, with_payload=True)
+            for vec in query_vectors[start:start + chunk_size]
+        ]
+        results.extend(client.search_batch(collection_name=COLLECTION_NAME, requests=requests))
     
     return results
 
-def rerank_results(reranker, query, results, top_n=5):
-    """2단계: Cross-Encoder로 재정렬"""
-    # 쿼리-문서 쌍 생성
+def predict_pairs(reranker, pairs, batch_size=128, processes=1):
+    """쿼리-문서 쌍 점수 계산 (processes > 1이면 CPU 워커 프로세스 풀로 나눠서 계산)
+    
+    멀티 프로세스 풀을 지원하지 않는 sentence-transformers 버전이면 현재 프로세스에서 계산
+    """
+    if processes > 1 and hasattr(reranker, 'start_multi_process_pool'):
+        pool = reranker.start_multi_process_pool(target_devices=['cpu'] * processes)
+        try:
+            return reranker.predict(pairs, batch_size=batch_size, convert_to_numpy=True, pool=pool)
+        finally:
+            reranker.stop_multi_process_pool(pool)
+    
+    return reranker.predict(pairs, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+
+def rerank_all(reranker, queries, all_results, top_n=5, batch_size=128, processes=1):
+    """2단계: Cross-Encoder로 재정렬 (전체 쿼리의 쿼리-문서 쌍을 predict 한 번으로 점수 계산)"""
+    # 쿼리-문서 쌍 생성 (쿼리별 구간은 offsets로 기억)
     pairs = []
-    for hit in results:
-        text = hit.payload.get('text', '')
-        pairs.append([query, text])
+    offsets = [0]
+    for query, results in zip(queries, all_results):
+        for hit in results:
+            pairs.append([query, hit.payload.get('text', '')])
+        offsets.append(len(pairs))
     
     # 재점수 계산
-    scores = reranker.predict(pairs)
-    
-    # 점수로 재정렬
-    ranked_indices = np.argsort(scores)[::-1][:top_n]
+    if pairs:
+        scores = predict_pairs(reranker, pairs, batch_size=batch_size, processes=processes)
+    else:
+        scores = np.empty(0, dtype=np.float32)
+    
+    return [
+        rerank_results(results, scores[offsets[i]:offsets[i + 1]], top_n=top_n)
+        for i, results in enumerate(all_results)
+    ]
+
+def rerank_results(results, scores, top_n=5):
+    """Cross-Encoder 점수로 한 쿼리의 결과 재정렬"""
+    # 점수로 재정렬 (상위 top_n만 골라서 그 안에서만 정렬)
+    top_n = min(top_n, len(scores))
+    if top_n == 0:
+        return [], []
+    top = np.argpartition(-scores, top_n - 1)[:top_n]
+    ranked_indices = top[np.argsort(-scores[top])]
     
     # 재정렬된 결과
     reranked = [results[i] for i in ranked_indices]
@@ -78,8 +122,14 @@ def rerank_results(reranker, query, results, top_n=5):
     
     return reranked, reranked_scores
 
-def evaluate_with_reranking(reranker_name='ms-marco-mini', initial_k=20, final_k=5):
-    """리랭킹 포함 평가"""
+def rank_metrics(top_indices, gt_indices, k=5):
+    """Top-k 기준 (Recall@1, Recall@k, MRR, 첫 정답 순위) - np.isin 한 번으로 적중 배열 계산"""
+    hits = np.isin(np.asarray(top_indices[:k], dtype=np.int64), gt_indices)
+    rank = int(hits.argmax()) + 1 if hits.any() else 0
+    return float(hits[:1].any()), float(hits.any()), (1.0 / rank if rank else 0.0), rank
+
+def evaluate_with_reranking(reranker_name='ms-marco-mini', initial_k=20, final_k=5, verbose=False):
+    """리랭킹 포함 평가 (verbose=True면 쿼리별 상세 출력)"""
     print("\n" + "=" * 80)
     print(f"🔄 리랭킹 평가: {reranker_name}")
     print("=" * 80)
@@ -88,8 +138,15 @@ def evaluate_with_reranking(reranker_name='ms-marco-mini', initial_k=20, final_k
     
     # 모델 로드
     print("\n📦 모델 로드 중...")
-    bi_encoder = SentenceTransformer('BAAI/bge-m3')
-    reranker = CrossEncoder(RERANKER_MODELS[reranker_name])
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    processes = RERANK_PROCESSES if device == 'cpu' else 1
+    print(f"   디바이스: {device} (리랭킹 프로세스: {processes})")
+    if device == 'cuda':
+        torch.backends.cudnn.benchmark = True  # 배치 모양이 고정적이라 cuDNN 커널 자동 선택이 이득
+    reranker = CrossEncoder(RERANKER_MODELS[reranker_name], device=device)
+    if device == 'cuda':
+        # GPU에서는 fp16으로 올려 리랭킹 속도와 메모리 개선 (CPU는 fp16이 오히려 느려 fp32 유지)
+        reranker.model.half()
     
     # Qdrant 클라이언트
     client = QdrantClient(url=QDRANT_URL)
@@ -100,28 +157,20 @@ def evaluate_with_reranking(reranker_name='ms-marco-mini', initial_k=20, final_k
     # Corpus 로드 (document_name 매핑용)
     corpus = pd.read_csv(DATA_DIR / "corpus_all.csv")
     
-    # Corpus에 base_document_name 컬럼 추가 (chunk 제거)
-    def get_base_doc_name(doc_name):
-        """chunk 접미사 제거하고 확장자도 제거"""
-        if not isinstance(doc_name, str):
-            return ""
-        # _chunkN 제거
-        base = doc_name.rsplit('_chunk', 1)[0] if '_chunk' in doc_name else doc_name
-        # 확장자 제거
-        base = base.replace('.pdf', '').replace('.xlsx', '').replace('.docx', '').strip()
-        return base
-    
-    corpus['base_doc_name'] = corpus['document_name'].apply(get_base_doc_name)
-    
-    # document_name → corpus_index 매핑 (Qdrant 검색 결과 매핑용)
-    doc_name_to_idx = {}
-    for idx, row in corpus.iterrows():
-        # document_name이 있으면 사용 (첨부파일)
-        if isinstance(row.get('document_name'), str) and row['document_name']:
-            doc_name_to_idx[row['document_name']] = idx
-        # document_name이 없으면 title 사용 (크롤링 데이터)
-        elif isinstance(row.get('title'), str) and row['title']:
-            doc_name_to_idx[row['title']] = idx
+    # Corpus에 base_document_name 컬럼 추가 (_chunkN 접미사와 확장자 제거, 컬럼 단위 str 연산)
+    corpus['base_doc_name'] = (
+        corpus['document_name'].fillna('').astype(str)
+        .str.rsplit('_chunk', n=1).str[0]
+        .str.replace(r'\.(pdf|xlsx|docx)', '', regex=True)
+        .str.strip()
+    )
+    
+    # document_name → corpus_index 매핑 (Qdrant 검색 결과 매핑용, 이름이 겹치면 마지막 행)
+    # document_name이 있으면 사용 (첨부파일), 없으면 title 사용 (크롤링 데이터)
+    has_doc_name = corpus['document_name'].notna() & (corpus['document_name'] != '')
+    doc_key = corpus['document_name'].where(has_doc_name, corpus['title'])
+    has_key = doc_key.notna() & (doc_key != '')
+    doc_name_to_idx = dict(zip(doc_key[has_key].tolist(), corpus.index[has_key].tolist()))
     
     # 평가
     recall_at_1_baseline = []
@@ -130,36 +179,57 @@ def evaluate_with_reranking(reranker_name='ms-marco-mini', initial_k=20, final_k
     recall_at_5_reranked = []
     mrr_baseline = []
     mrr_reranked = []
+    per_query = []
     
     evaluated = 0
     
-    for _, row in gt_df.iterrows():
-        query = row['query']
-        gt_doc_name = row['document_name']
-        
-        if not isinstance(query, str) or not isinstance(gt_doc_name, str):
-            continue
-        
+    gt_df = gt_df[gt_df['query'].apply(lambda q: isinstance(q, str))
+                  & gt_df['document_name'].apply(lambda d: isinstance(d, str))]
+    
+    # GT에 해당하는 corpus 인덱스 찾기 (없는 쿼리는 인코딩/검색/리랭킹 전에 제외)
+    # base_doc_name → 인덱스, title → 인덱스는 한 번만 만들고 쿼리마다 dict 조회
+    gt_by_base = corpus.groupby('base_doc_name').indices
+    gt_by_title = corpus.groupby('title').indices
+    
+    no_gt = np.empty(0, dtype=np.int64)
+    all_gt_indices = []
+    for gt_doc_name in gt_df['document_name']:
         # GT 문서명 정규화 (확장자 제거)
         gt_base = gt_doc_name.replace('.pdf', '').replace('.xlsx', '').replace('.docx', '').strip()
         
-        # GT에 해당하는 corpus 인덱스 찾기
-        # 1. base_doc_name으로 매칭 (첨부파일)
-        gt_indices = set(corpus[corpus['base_doc_name'] == gt_base].index.tolist())
-        
-        # 2. title로 매칭 (크롤링 데이터)
-        if not gt_indices:
-            gt_indices = set(corpus[corpus['title'] == gt_doc_name].index.tolist())
-        
-        if not gt_indices:
-            # 디버깅: 매칭 실패 케이스 출력
-            # print(f"⚠️ 매칭 실패: {query[:40]}...")
-            # print(f"   GT: '{gt_doc_name}'")
-            # print(f"   GT base: '{gt_base}'")
-            continue
+        # 1. base_doc_name으로 매칭 (첨부파일), 2. 없으면 title로 매칭 (크롤링 데이터)
+        gt_indices = gt_by_base.get(gt_base)
+        if gt_indices is None:
+            gt_indices = gt_by_title.get(gt_doc_name, no_gt)
+        all_gt_indices.append(gt_indices)
+    
+    has_gt = [len(gt_indices) > 0 for gt_indices in all_gt_indices]
+    gt_df = gt_df[has_gt]
+    all_gt_indices = [gt_indices for gt_indices in all_gt_indices if len(gt_indices)]
+    
+    # 쿼리 임베딩 (디스크 캐시 → 리랭커를 바꿔 다시 실행해도 BGE-M3 재인코딩 없음)
+    # Bi-Encoder는 캐시 미스가 있을 때만 로드 (GPU면 fp16)
+    def load_model():
+        print(f"   {EMBED_MODEL} 로드 (캐시에 없는 쿼리 인코딩)...")
+        return get_embed_model(EMBED_MODEL)
+    
+    # 추론 전용 구간은 inference_mode (autograd 버전 카운터/뷰 추적 생략)
+    with torch.inference_mode():
+        query_vectors = get_or_encode(gt_df['query'].tolist(), load_model, default_cache_path(EMBED_MODEL))
+    
+    # 1단계: 초기 검색 (Top-K) - 전체 쿼리를 배치로 검색
+    all_initial_results = initial_search(client, query_vectors, top_k=initial_k)
+    
+    # 2단계: 리랭킹 - 전체 쿼리의 쌍을 한 번에 점수 계산
+    with torch.inference_mode():
+        all_reranked = rerank_all(reranker, gt_df['query'].tolist(), all_initial_results, top_n=final_k, processes=processes)
+    
+    for q_idx, (_, row) in enumerate(gt_df.iterrows()):
+        query = row['query']
+        gt_doc_name = row['document_name']
+        gt_indices = all_gt_indices[q_idx]
         
-        # 1단계: 초기 검색 (Top-K)
-        initial_results = initial_search(client, bi_encoder, query, top_k=initial_k)
+        initial_results = all_initial_results[q_idx]
         
         # Baseline 평가 (Top-5)
         baseline_top5 = initial_results[:final_k]
@@ -175,23 +245,14 @@ def evaluate_with_reranking(reranker_name='ms-marco-mini', initial_k=20, final_k
                 if title and title in doc_name_to_idx:
                     baseline_indices.append(doc_name_to_idx[title])
         
-        # Baseline Recall
-        found_in_baseline = any(idx in gt_indices for idx in baseline_indices[:1])
-        recall_at_1_baseline.append(1.0 if found_in_baseline else 0.0)
-        
-        found_in_baseline_5 = any(idx in gt_indices for idx in baseline_indices[:final_k])
-        recall_at_5_baseline.append(1.0 if found_in_baseline_5 else 0.0)
-        
-        # Baseline MRR
-        rank = 0
-        for i, idx in enumerate(baseline_indices[:final_k], 1):
-            if idx in gt_indices:
-                rank = i
-                break
-        mrr_baseline.append(1.0 / rank if rank > 0 else 0.0)
+        # Baseline Recall / MRR
+        recall_1, recall_5, mrr, baseline_rank = rank_metrics(baseline_indices, gt_indices, k=final_k)
+        recall_at_1_baseline.append(recall_1)
+        recall_at_5_baseline.append(recall_5)
+        mrr_baseline.append(mrr)
         
-        # 2단계: 리랭킹
-        reranked_results, reranked_scores = rerank_results(reranker, query, initial_results, top_n=final_k)
+        # 2단계: 리랭킹 결과
+        reranked_results, reranked_scores = all_reranked[q_idx]
         
         # 리랭킹 후 평가
         reranked_indices = []
@@ -206,42 +267,48 @@ def evaluate_with_reranking(reranker_name='ms-marco-mini', initial_k=20, final_k
                 if title and title in doc_name_to_idx:
                     reranked_indices.append(doc_name_to_idx[title])
         
-        # Reranked Recall
-        found_in_reranked = any(idx in gt_indices for idx in reranked_indices[:1])
-        recall_at_1_reranked.append(1.0 if found_in_reranked else 0.0)
-        
-        found_in_reranked_5 = any(idx in gt_indices for idx in reranked_indices[:final_k])
-        recall_at_5_reranked.append(1.0 if found_in_reranked_5 else 0.0)
-        
-        # Reranked MRR
-        rank = 0
-        for i, idx in enumerate(reranked_indices[:final_k], 1):
-            if idx in gt_indices:
-                rank = i
-                break
-        mrr_reranked.append(1.0 / rank if rank > 0 else 0.0)
+        # Reranked Recall / MRR
+        recall_1, recall_5, mrr, rank = rank_metrics(reranked_indices, gt_indices, k=final_k)
+        recall_at_1_reranked.append(recall_1)
+        recall_at_5_reranked.append(recall_5)
+        mrr_reranked.append(mrr)
         
         evaluated += 1
         
-        # 첫 3개 쿼리는 상세 디버깅
-        if evaluated <= 3:
+        # 쿼리별 결과는 모아 두었다가 루프가 끝난 뒤 CSV로 한 번에 저장
+        per_query.append({
+            'query': query,
+            'gt_document_name': gt_doc_name,
+            'baseline_top_indices': baseline_indices,
+            'reranked_top_indices': reranked_indices,
+            'baseline_rank': baseline_rank,
+            'reranked_rank': rank,
+        })
+        
+        # 쿼리별 상세 디버깅 (--verbose)
+        if verbose:
             print(f"\n🔍 디버깅 #{evaluated}: {query[:50]}...")
+            gt_base = gt_doc_name.replace('.pdf', '').replace('.xlsx', '').replace('.docx', '').strip()
             print(f"   GT 문서: '{gt_doc_name}' (base: '{gt_base}')")
-            print(f"   GT 인덱스: {list(gt_indices)[:3]}...")
+            print(f"   GT 인덱스: {gt_indices[:3].tolist()}...")
             print(f"   Baseline Top-5 인덱스: {baseline_indices}")
             print(f"   Reranked Top-5 인덱스: {reranked_indices}")
-            print(f"   Baseline Hit: {any(idx in gt_indices for idx in baseline_indices)}")
-            print(f"   Reranked Hit: {any(idx in gt_indices for idx in reranked_indices)}")
+            print(f"   Baseline Hit: {baseline_rank > 0}")
+            print(f"   Reranked Hit: {rank > 0}")
         
         if evaluated % 10 == 0:
             print(f"   진행: {evaluated}/{len(gt_df)}...")
     
+    # 쿼리별 결과 저장
+    per_query_path = DATA_DIR / f"reranking_per_query_{reranker_name}.csv"
+    pd.DataFrame(per_query).to_csv(per_query_path, index=False, encoding='utf-8')
+    
     # 결과 출력
     print("\n" + "=" * 80)
     print("📊 결과")
     print("=" * 80)
     
-    print(f"\n평가 쿼리: {evaluated}개")
+    print(f"\n평가 쿼리: {evaluated}개 (쿼리별 결과: {per_query_path})")
     
     print("\n🔹 Baseline (BGE-M3만)")
     print(f"   Recall@1: {np.mean(recall_at_1_baseline):.2%}")
@@ -272,6 +339,12 @@ def evaluate_with_reranking(reranker_name='ms-marco-mini', initial_k=20, final_k
     }
 
 def main():
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='리랭킹 성능 테스트')
+    parser.add_argument('--verbose', action='store_true', help='쿼리별 상세 결과 출력')
+    args = parser.parse_args()
+    
     print("=" * 80)
     print("🔄 리랭킹 성능 테스트")
     print("=" * 80)
@@ -314,7 +387,8 @@ def main():
     results = evaluate_with_reranking(
         reranker_name=choice,
         initial_k=20,  # 1단계: Top-20
-        final_k=5      # 2단계: Top-5
+        final_k=5,     # 2단계: Top-5
+        verbose=args.verbose
     )
     
     print("\n" + "=" * 80)
@@ -2,13 +2,13 @@
 """
 corpus_all.csv + bge_all.npy를 Qdrant에 업로드
 """
+import os
 import numpy as np
 import pandas as pd
 from pathlib import Path
 from qdrant_client import QdrantClient
 from qdrant_client.http import models as qm
 import hashlib
-from tqdm import tqdm
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 DATA_DIR = PROJECT_ROOT / "data"
@@ -18,13 +18,20 @@ EMBEDDINGS_DIR = PROJECT_ROOT / "embeddings"
 CORPUS_CSV = DATA_DIR / "corpus_all.csv"
 EMBEDDINGS_NPY = EMBEDDINGS_DIR / "bge_all.npy"
 QDRANT_URL = "http://localhost:6333"
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "0") == "1"  # gRPC(6334) 전송 사용 여부
 COLLECTION_NAME = "kit_corpus_bge_all"
-BATCH_SIZE = 100
+BATCH_SIZE = 512
+UPLOAD_PARALLEL = int(os.getenv("UPLOAD_PARALLEL", "4"))  # 동시 업로드 워커 수 (배치 왕복 지연을 겹침)
 
-def generate_id(text: str, url: str) -> str:
-    """텍스트와 URL을 조합하여 고유 ID 생성"""
-    combined = f"{url}::{text[:100]}"
-    return hashlib.md5(combined.encode()).hexdigest()
+# 대량 업로드 중에는 HNSW 인덱싱을 끄고(0) 업로드가 끝나면 기본값으로 다시 켬
+INDEXING_THRESHOLD = 20000
+
+PAYLOAD_FIELDS = ('text', 'url', 'title', 'source_type', 'document_name')
+
+def generate_ids(texts: pd.Series, urls: pd.Series) -> list:
+    """텍스트와 URL을 조합하여 고유 ID 생성 (조합 문자열은 pandas str 연산으로 한 번에 만듦)"""
+    combined = urls.astype(str) + '::' + texts.str.slice(0, 100)
+    return [hashlib.md5(s.encode()).hexdigest() for s in combined]
 
 def main():
     print("=" * 80)
@@ -37,7 +44,8 @@ def main():
     print(f"   Embeddings: {EMBEDDINGS_NPY}")
     
     df = pd.read_csv(CORPUS_CSV)
-    embeddings = np.load(EMBEDDINGS_NPY)
+    # 전체 행렬을 RAM에 올리지 않고 memmap으로 열어 필요한 행만 읽음
+    embeddings = np.load(EMBEDDINGS_NPY, mmap_mode='r')
     
     # NaN 제거 (임베딩 생성 시와 동일한 필터링)
     df = df[df['text'].notna()].reset_index(drop=True)
@@ -56,7 +64,7 @@ def main():
     print(f"\n🔌 Qdrant 연결 중...")
     print(f"   URL: {QDRANT_URL}")
     
-    client = QdrantClient(url=QDRANT_URL)
+    client = QdrantClient(url=QDRANT_URL, prefer_grpc=QDRANT_PREFER_GRPC)
     
     # 3. 컬렉션 생성 (기존 것이 있으면 삭제)
     print(f"\n📦 컬렉션 생성 중...")
@@ -77,58 +85,61 @@ def main():
         vectors_config=qm.VectorParams(
             size=embeddings.shape[1],
             distance=qm.Distance.COSINE
-        )
+        ),
+        optimizers_config=qm.OptimizersConfigDiff(indexing_threshold=0)
     )
+    
+    # 필터에 쓰일 수 있는 payload 필드 인덱스 (title/source_type 기준 필터 검색을 빠르게)
+    for field_name in ('title', 'source_type'):
+        client.create_payload_index(
+            collection_name=COLLECTION_NAME,
+            field_name=field_name,
+            field_schema=qm.PayloadSchemaType.KEYWORD
+        )
     print(f"   ✅ 컬렉션 생성 완료")
     
-    # 4. 데이터 업로드
+    # 4. 데이터 업로드 (ID/payload는 루프 밖에서 한 번에 만들고, 벡터는 memmap 그대로 전달)
     print(f"\n⏳ 데이터 업로드 중...")
-    print(f"   배치 크기: {BATCH_SIZE}")
-    
-    points = []
-    uploaded = 0
-    
-    for idx, row in tqdm(df.iterrows(), total=len(df), desc="업로드"):
-        # Point 생성
-        point_id = generate_id(str(row.get('text', '')), str(row.get('url', '')))
-        
-        payload = {
-            'text': str(row.get('text', '')),
-            'url': str(row.get('url', '')),
-            'title': str(row.get('title', '')),
-            'source_type': str(row.get('source_type', '')),
-            'document_name': str(row.get('document_name', '')),
-        }
-        
-        # NaN 값 처리
-        payload = {k: (v if pd.notna(v) and v != 'nan' else '') for k, v in payload.items()}
-        
-        point = qm.PointStruct(
-            id=point_id,
-            vector=embeddings[idx].tolist(),
-            payload=payload
-        )
-        
-        points.append(point)
-        
-        # 배치 업로드
-        if len(points) >= BATCH_SIZE:
-            client.upsert(
-                collection_name=COLLECTION_NAME,
-                points=points,
-                wait=True
-            )
-            uploaded += len(points)
-            points = []
-    
-    # 남은 데이터 업로드
-    if points:
+    print(f"   배치 크기: {BATCH_SIZE}, 워커: {UPLOAD_PARALLEL}")
+    
+    ids = generate_ids(df['text'], pd.Series(df.get('url', ''), index=df.index))
+    
+    # NaN 값 처리 (컬럼 단위로 문자열 변환 후 'nan'을 빈 문자열로)
+    payload_df = df.reindex(columns=list(PAYLOAD_FIELDS)).astype(str)
+    payloads = payload_df.mask(payload_df == 'nan', '').to_dict('records')
+    
+    # upload_collection이 배치 단위로 잘라 여러 워커에서 동시에 업로드 (float16 저장본도 지원)
+    # 배치마다 반영을 기다리지 않고(wait=False) 보내기만 함
+    client.upload_collection(
+        collection_name=COLLECTION_NAME,
+        vectors=embeddings,
+        payload=payloads,
+        ids=ids,
+        batch_size=BATCH_SIZE,
+        parallel=UPLOAD_PARALLEL,
+        max_retries=3,
+        wait=False
+    )
+    uploaded = len(ids)
+    
+    # 마지막 포인트를 wait=True로 한 번 더 upsert → 업데이트는 순서대로 적용되므로
+    # 이 요청이 끝나면 앞서 보낸 배치도 모두 반영됨 (같은 ID/내용이라 결과는 동일)
+    if uploaded:
         client.upsert(
             collection_name=COLLECTION_NAME,
-            points=points,
+            points=qm.Batch(
+                ids=ids[-1:],
+                vectors=np.asarray(embeddings[-1:], dtype=np.float32).tolist(),
+                payloads=payloads[-1:]
+            ),
             wait=True
         )
-        uploaded += len(points)
+    
+    # HNSW 인덱싱 다시 켜기 (백그라운드에서 인덱스 구축)
+    client.update_collection(
+        collection_name=COLLECTION_NAME,
+        optimizers_config=qm.OptimizersConfigDiff(indexing_threshold=INDEXING_THRESHOLD)
+    )
     
     print(f"\n✅ 업로드 완료!")
     
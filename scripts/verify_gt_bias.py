@@ -6,16 +6,34 @@ Ground Truth 편향 검증
 방법: 각 GT 항목을 선택한 모델이 무엇인지 확인
 """
 
+import os
+import re
 import pandas as pd
+import torch
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
 from qdrant_client import QdrantClient
+from qdrant_client.http import models as qm
 import warnings
 warnings.filterwarnings('ignore')
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 DATA_DIR = PROJECT_ROOT / "data"
 
+# CPU 추론 스레드 수 (기본: 전체 코어)
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", str(os.cpu_count() or 1)))
+torch.set_num_threads(TORCH_THREADS)
+
+# CPU에서 쿼리 인코딩을 나눠 맡을 워커 프로세스 수 (1이면 현재 프로세스에서 인코딩)
+# 워커마다 모델을 새로 로드하므로 쿼리가 많을 때만 이득 → 기본 1
+ENCODE_PROCESSES = int(os.getenv("ENCODE_PROCESSES", "1"))
+
+# 문서명 확장자 (.pdf/.xlsx/.docx 모두 제거 - 기존 replace 체인과 동일하게 위치 무관)
+_EXT_RE = re.compile(r'\.(?:pdf|xlsx|docx)')
+
+# GT 문서를 찾는 범위 (Recall@5) - 검색도 이만큼만 요청 (Top-K 밖 결과는 평가에 쓰이지 않음)
+TOP_K = 5
+
 # 테스트할 모델들
 MODELS = {
     'BGE-M3': 'BAAI/bge-m3',
@@ -31,24 +49,51 @@ def load_gt():
     # rank > 0인 것만
     return gt_df[gt_df['rank'] > 0].copy()
 
-def search_with_model(model_name, model, client, query, collection_name, top_k=10):
-    """특정 모델로 검색"""
+def encode_queries(model_name, model, queries, batch_size=64, processes=1):
+    """특정 모델로 쿼리 전체를 한 번에 인코딩 (쿼리마다 batch=1로 인코딩하지 않도록)
+    
+    processes > 1이면 CPU 워커 프로세스 풀로 나눠서 인코딩
+    """
     # E5는 쿼리 prefix 필요
     if 'e5' in model_name.lower():
-        query_text = f"query: {query}"
-    else:
-        query_text = query
-    
-    query_vector = model.encode(query_text, normalize_embeddings=True).tolist()
-    
-    results = client.search(
-        collection_name=collection_name,
-        query_vector=query_vector,
-        limit=top_k
+        queries = [f"query: {query}" for query in queries]
+    
+    if processes > 1:
+        pool = model.start_multi_process_pool(target_devices=['cpu'] * processes)
+        try:
+            return model.encode_multi_process(queries, pool, batch_size=batch_size, normalize_embeddings=True)
+        finally:
+            model.stop_multi_process_pool(pool)
+    
+    return model.encode(
+        queries,
+        batch_size=batch_size,
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+        show_progress_bar=True
     )
+
+def search_all(client, collection_name, query_vectors, top_k=TOP_K, chunk_size=64):
+    """쿼리 벡터 전체를 search_batch로 묶어서 검색 (쿼리마다 왕복하지 않도록)"""
+    results = []
+    for start in range(0, len(query_vectors), chunk_size):
+        requests = [
+            qm.SearchRequest(
+                vector=vec.tolist(),
+                limit=top_k,
+                with_payload=['document_name', 'title'],  # GT 비교에 쓰는 필드만
+                with_vector=False
+            )
+            for vec in query_vectors[start:start + chunk_size]
+        ]
+        results.extend(client.search_batch(collection_name=collection_name, requests=requests))
     
     return results
 
+def normalize_doc_name(doc_name):
+    """문서명 정규화 (확장자 제거를 정규식 한 번으로)"""
+    return _EXT_RE.sub('', doc_name).strip()
+
 def get_doc_titles(results):
     """검색 결과에서 문서 제목 추출"""
     titles = []
@@ -58,26 +103,20 @@ def get_doc_titles(results):
         if not doc_name:
             doc_name = hit.payload.get('title', '')
         
-        # chunk 제거
-        if '_chunk' in doc_name:
-            doc_name = doc_name.rsplit('_chunk', 1)[0]
-        
-        # 확장자 제거
-        doc_name = doc_name.replace('.pdf', '').replace('.xlsx', '').replace('.docx', '').strip()
-        
-        titles.append(doc_name)
+        # chunk 제거 후 확장자 제거
+        titles.append(normalize_doc_name(doc_name.rsplit('_chunk', 1)[0]))
     
     return titles
 
-def check_gt_in_topk(gt_doc, search_results, k=5):
+def check_gt_in_topk(gt_doc, search_results, k=TOP_K):
     """GT 문서가 Top-K에 있는지 확인"""
-    titles = get_doc_titles(search_results)
+    titles = get_doc_titles(search_results[:k])  # Top-K 밖의 결과는 정규화하지 않음
     
     # GT 문서명 정규화
-    gt_normalized = gt_doc.replace('.pdf', '').replace('.xlsx', '').replace('.docx', '').strip()
+    gt_normalized = normalize_doc_name(gt_doc)
     
     # Top-K 확인
-    for i, title in enumerate(titles[:k], 1):
+    for i, title in enumerate(titles, 1):
         if gt_normalized == title or gt_normalized in title or title in gt_normalized:
             return True, i
     
@@ -108,33 +147,37 @@ def main():
     # 결과 저장
     results = {model: {'found': 0, 'total': 0, 'ranks': []} for model in MODELS}
     
-    print("\n🔍 모델 로드 중...")
-    models = {}
-    for name, path in MODELS.items():
-        print(f"   {name}...", end='', flush=True)
-        models[name] = SentenceTransformer(path)
-        print(" ✅")
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    processes = ENCODE_PROCESSES if device == 'cpu' else 1
+    print(f"\n🔍 디바이스: {device} (인코딩 프로세스: {processes})")
+    if device == 'cuda':
+        torch.backends.cudnn.benchmark = True  # 배치 모양이 고정적이라 cuDNN 커널 자동 선택이 이득
     
     print("\n📊 평가 진행 중...\n")
     
-    # 각 GT 항목 평가
-    for idx, row in gt_df.iterrows():
-        query = row['query']
-        gt_doc = row['document_name']
+    queries = gt_df['query'].tolist()
+    gt_docs = gt_df['document_name'].tolist()
+    
+    # 모델별로 로드 → 쿼리 전체 일괄 인코딩 → 해제 (네 모델을 동시에 메모리에 올리지 않음)
+    for model_name, model_path in MODELS.items():
+        print(f"   {model_name} 로드...", end='', flush=True)
+        model = SentenceTransformer(model_path, device=device)
+        if device == 'cuda':
+            model.half()  # GPU에서는 fp16 (CPU는 fp32 유지)
+        print(" ✅")
         
-        if idx % 10 == 0:
-            print(f"   진행: {idx}/{len(gt_df)}...")
+        collection = collections[model_name]
+        # 추론 전용 구간은 inference_mode (autograd 버전 카운터/뷰 추적 생략)
+        with torch.inference_mode():
+            query_vectors = encode_queries(model_name, model, queries, processes=processes)
+        del model
         
-        # 각 모델로 검색
-        for model_name in MODELS:
-            collection = collections[model_name]
-            model = models[model_name]
-            
-            # 검색
-            search_results = search_with_model(model_name, model, client, query, collection, top_k=10)
-            
+        # 검색 (컬렉션마다 일괄 요청)
+        all_search_results = search_all(client, collection, query_vectors, top_k=TOP_K)
+        
+        for gt_doc, search_results in zip(gt_docs, all_search_results):
             # GT 문서가 Top-5에 있는지 확인
-            found, rank = check_gt_in_topk(gt_doc, search_results, k=5)
+            found, rank = check_gt_in_topk(gt_doc, search_results, k=TOP_K)
             
             results[model_name]['total'] += 1
             if found: